@@ -1,8 +1,24 @@
 #!/usr/bin/env python3
 """Apple Music CLI for OpenClaw — iTunes Search API + Music.app AppleScript control."""
 import json, sys, os, subprocess, urllib.request, urllib.parse
+import time, hashlib, threading, contextlib
+try:
+    import fcntl
+except ImportError:   # no cross-process locking on Windows
+    fcntl = None
 
 ITUNES_API = "https://itunes.apple.com"
+CONFIG_DIR = os.path.expanduser("~/.config/openclaw-ears")
+CACHE_DIR = os.path.join(CONFIG_DIR, "itunes-cache")
+RATE_FILE = os.path.join(CONFIG_DIR, "itunes-rate.json")
+FETCH_LOCK = os.path.join(CACHE_DIR, "fetch.lock")
+os.makedirs(CACHE_DIR, exist_ok=True)
+
+ITUNES_TIMEOUT = 15
+CACHE_TTL = 24 * 3600
+CACHE_MAX_BYTES = 20 * 1024 * 1024
+RATE_LIMIT = 20          # Apple allows roughly this many requests per minute
+RATE_WINDOW = 60
 
 def osascript(script):
     """Run AppleScript and return output."""
@@ -18,23 +34,111 @@ def osascript(script):
         raise RuntimeError(result.stderr.strip())
     return result.stdout.strip()
 
+@contextlib.contextmanager
+def file_lock(path):
+    """Exclusive advisory lock on `path` (created if missing), shared across processes."""
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        if fcntl:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+def wait_for_slot():
+    """Block until a request fits in RATE_LIMIT per RATE_WINDOW, counted across
+    all applemusic.py processes, so requests queue instead of being throttled."""
+    while True:
+        with file_lock(RATE_FILE + ".lock"):
+            try:
+                with open(RATE_FILE) as f:
+                    stamps = json.load(f)
+            except (OSError, ValueError):
+                stamps = []
+            now = time.time()
+            stamps = [t for t in stamps if t > now - RATE_WINDOW]
+            if len(stamps) < RATE_LIMIT:
+                with open(RATE_FILE, "w") as f:
+                    json.dump(stamps + [now], f)
+                return
+            wait = stamps[0] + RATE_WINDOW - now
+        time.sleep(wait)
+
+def _evict_cache():
+    """Drop least recently used entries until the cache fits CACHE_MAX_BYTES."""
+    entries = []
+    for name in os.listdir(CACHE_DIR):
+        path = os.path.join(CACHE_DIR, name)
+        if name.endswith(".json"):
+            st = os.stat(path)
+            entries.append((st.st_mtime, st.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= CACHE_MAX_BYTES:
+            break
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+        total -= size
+
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+def itunes_get(endpoint, params):
+    """GET an iTunes API endpoint, cached on disk for CACHE_TTL.
+
+    The cache key is the normalized query (sorted params, search term
+    case- and whitespace-folded). Identical concurrent requests share one
+    fetch: threads wait on the first, and processes take turns fetching
+    (they're rate-limited anyway) and re-check the cache first.
+    """
+    params = {k: str(v) for k, v in params.items() if v is not None}
+    if "term" in params:
+        params["term"] = " ".join(params["term"].lower().split())
+    query = urllib.parse.urlencode(sorted(params.items()))
+    key = hashlib.sha1(f"{endpoint}?{query}".encode()).hexdigest()
+    path = os.path.join(CACHE_DIR, f"{key}.json")
+
+    def cached():
+        try:
+            if time.time() - os.path.getmtime(path) < CACHE_TTL:
+                with open(path) as f:
+                    data = json.load(f)
+                os.utime(path)   # mark as recently used
+                return data
+        except (OSError, ValueError):
+            pass
+        return None
+
+    data = cached()
+    if data is not None:
+        return data
+    with _inflight_lock:
+        lock = _inflight.setdefault(key, threading.Lock())
+    with lock, file_lock(FETCH_LOCK):
+        data = cached()
+        if data is None:
+            wait_for_slot()
+            url = f"{ITUNES_API}/{endpoint}?{query}"
+            with urllib.request.urlopen(url, timeout=ITUNES_TIMEOUT) as resp:
+                data = json.loads(resp.read())
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp, path)
+            _evict_cache()
+    with _inflight_lock:
+        _inflight.pop(key, None)
+    return data
+
 def itunes_search(term, media="music", entity=None, limit=20, country="US"):
     """Search iTunes/Apple Music catalog."""
-    params = {"term": term, "media": media, "limit": limit, "country": country}
-    if entity:
-        params["entity"] = entity
-    url = f"{ITUNES_API}/search?{urllib.parse.urlencode(params)}"
-    data = json.loads(urllib.request.urlopen(url).read())
-    return data.get("results", [])
+    params = {"term": term, "media": media, "limit": limit, "country": country, "entity": entity}
+    return itunes_get("search", params).get("results", [])
 
 def itunes_lookup(ids, entity=None):
     """Lookup by Apple Music IDs."""
-    params = {"id": ",".join(str(i) for i in ids)}
-    if entity:
-        params["entity"] = entity
-    url = f"{ITUNES_API}/lookup?{urllib.parse.urlencode(params)}"
-    data = json.loads(urllib.request.urlopen(url).read())
-    return data.get("results", [])
+    params = {"id": ",".join(str(i) for i in ids), "entity": entity}
+    return itunes_get("lookup", params).get("results", [])
 
 def print_tracks(results):
     for i, r in enumerate(results, 1):
@@ -0,0 +1,140 @@
+"""Signed audio URL cache and resumable downloads shared by netease.py and qqmusic.py."""
+import json, os, time, sqlite3, urllib.request, urllib.error
+
+CONFIG_DIR = os.path.expanduser("~/.config/openclaw-ears")
+URL_CACHE = os.path.join(CONFIG_DIR, "audio-urls.db")
+os.makedirs(CONFIG_DIR, exist_ok=True)
+
+URL_CACHE_MAX = 2000     # signed URLs kept, least recently used dropped first
+URL_EXPIRY_MARGIN = 60
+DOWNLOAD_TIMEOUT = 30
+CHUNK_SIZE = 256 * 1024
+
+# --- Signed audio URL cache, keyed by (provider, track id, bitrate) ---
+
+def _url_db():
+    db = sqlite3.connect(URL_CACHE, timeout=10)
+    db.execute("CREATE TABLE IF NOT EXISTS urls (provider TEXT, id TEXT, bitrate INTEGER, url TEXT, "
+               "info TEXT, expires_at REAL, used_at REAL, PRIMARY KEY (provider, id, bitrate))")
+    return db
+
+def url_cache_get(provider, ids, bitrate):
+    """{id: info} for cached URLs that are still valid, marking them used."""
+    db = _url_db()
+    found = {}
+    with db:
+        for tid in ids:
+            row = db.execute("SELECT info FROM urls WHERE provider = ? AND id = ? AND bitrate = ? AND expires_at > ?",
+                             (provider, str(tid), bitrate, time.time() + URL_EXPIRY_MARGIN)).fetchone()
+            if row:
+                found[tid] = json.loads(row[0])
+                db.execute("UPDATE urls SET used_at = ? WHERE provider = ? AND id = ? AND bitrate = ?",
+                           (time.time(), provider, str(tid), bitrate))
+    db.close()
+    return found
+
+def url_cache_put(provider, bitrate, entries):
+    """Store {id: (info, expires_at)}, where info["url"] is the signed URL."""
+    db = _url_db()
+    with db:
+        db.executemany("INSERT OR REPLACE INTO urls VALUES (?, ?, ?, ?, ?, ?, ?)",
+                       [(provider, str(tid), bitrate, info["url"], json.dumps(info), expires_at, time.time())
+                        for tid, (info, expires_at) in entries.items()])
+        db.execute("DELETE FROM urls WHERE expires_at < ?", (time.time(),))
+        db.execute("DELETE FROM urls WHERE rowid NOT IN (SELECT rowid FROM urls ORDER BY used_at DESC LIMIT ?)",
+                   (URL_CACHE_MAX,))
+    db.close()
+
+def url_cache_invalidate(url):
+    db = _url_db()
+    with db:
+        db.execute("DELETE FROM urls WHERE url = ?", (url,))
+    db.close()
+
+# --- Resumable downloads ---
+
+def remote_size(url):
+    """Content-Length from a HEAD request, or None."""
+    try:
+        req = urllib.request.Request(url, method="HEAD")
+        with urllib.request.urlopen(req, timeout=DOWNLOAD_TIMEOUT) as resp:
+            length = resp.headers.get("Content-Length")
+            return int(length) if length else None
+    except (OSError, ValueError):
+        return None
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def _part_size(part):
+    """Full size recorded when `part` was started, or None."""
+    try:
+        with open(part + ".json") as f:
+            return json.load(f)["size"]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+def fetch_to(url, path, expected=None, progress=None):
+    """Download `url` to `path`; returns bytes transferred, or None if `path`
+    was already complete.
+
+    Data goes to `path.part`, which a later run resumes with a Range
+    request, and is renamed into place once done. The full size is kept in
+    `path.part.json`; a .part whose recorded size doesn't match this
+    download (another bitrate or encoding) is started over rather than
+    spliced. `expected` is the size the API reported; without it, the
+    server's Content-Length decides. A 403/404 drops `url` from the URL
+    cache. `progress`, if given, gets add_bytes(n) per chunk.
+    """
+    part = path + ".part"
+    if os.path.exists(path):
+        if expected is None:
+            expected = remote_size(url)
+        if os.path.getsize(path) == expected:
+            return None
+    offset = 0
+    if os.path.exists(part):
+        if expected is None:
+            expected = remote_size(url)
+        if expected and _part_size(part) == expected:
+            offset = min(os.path.getsize(part), expected)
+    req = urllib.request.Request(url, headers={"Range": f"bytes={offset}-"} if offset else {})
+    try:
+        resp = urllib.request.urlopen(req, timeout=DOWNLOAD_TIMEOUT)
+    except urllib.error.HTTPError as e:
+        if e.code == 416 and offset:   # .part already holds everything
+            os.replace(part, path)
+            _remove(part + ".json")
+            return 0
+        if e.code in (403, 404):
+            url_cache_invalidate(url)
+        raise
+    size = 0
+    with resp:
+        if offset and resp.status != 206:
+            offset = 0   # Range ignored: start over
+        length = resp.headers.get("Content-Length")
+        total = offset + int(length) if length else expected
+        if not offset:
+            if total:
+                with open(part + ".json", "w") as f:
+                    json.dump({"size": total}, f)
+            else:
+                _remove(part + ".json")
+        with open(part, "ab" if offset else "wb") as f:
+            while True:
+                chunk = resp.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                f.write(chunk)
+                size += len(chunk)
+                if progress:
+                    progress.add_bytes(len(chunk))
+    if total and os.path.getsize(part) < total:
+        raise IOError(f"incomplete download ({os.path.getsize(part)} of {total} bytes)")
+    os.replace(part, path)
+    _remove(part + ".json")
+    return size
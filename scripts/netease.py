@@ -1,11 +1,49 @@
 #!/usr/bin/env python3
 """Netease Cloud Music CLI for OpenClaw — via pyncm."""
-import json, sys, os
+import json, sys, os, re, time, threading, collections, sqlite3, socket, socketserver, subprocess, shutil, signal, tempfile
+import urllib.request, urllib.parse, urllib.error
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import audio_cache
+from audio_cache import url_cache_get, url_cache_put, url_cache_invalidate
 
 CONFIG_DIR = os.path.expanduser("~/.config/openclaw-ears")
 SESSION_FILE = os.path.join(CONFIG_DIR, "netease-session.json")
+TRACK_CACHE = os.path.join(CONFIG_DIR, "netease-tracks.db")
+WORKER_SOCKET = os.path.join(CONFIG_DIR, "netease.sock")
+PLAY_PID_FILE = os.path.join(tempfile.gettempdir(), "ears-play.pid")
 os.makedirs(CONFIG_DIR, exist_ok=True)
 
+DOWNLOAD_WORKERS = 8     # tracks downloading at once
+HOST_CONCURRENCY = 4     # of which at most this many from one CDN host
+DOWNLOAD_TIMEOUT = 30
+CHUNK_SIZE = 256 * 1024
+AUDIO_BATCH = 200        # track IDs per GetTrackAudio request
+BITRATE_LADDER = (999000, 320000, 128000)
+URL_DEFAULT_TTL = 600    # when a URL doesn't say how long it lasts
+PRIME_BYTES = 64 * 1024  # handed to a streaming player before `play` returns
+# Players that can start on a partial stream from stdin ("-"), in order of preference
+STREAM_PLAYERS = (
+    ["mpv", "--no-video", "--really-quiet", "-"],
+    ["ffplay", "-nodisp", "-autoexit", "-loglevel", "quiet", "-"],
+)
+DETAIL_BATCH = 500       # track IDs per GetTrackDetail request
+DETAIL_CONCURRENCY = 4
+TRACK_CACHE_TTL = 30 * 86400
+SEARCH_PAGE = 100        # results per cloudsearch request
+SEARCH_CONCURRENCY = 4
+VERIFY_TTL = int(os.environ.get("NETEASE_VERIFY_TTL", 6 * 3600))   # re-check login after this long
+
+def write_json_atomic(path, data):
+    """Write JSON via a temp file + rename so readers never see a partial file."""
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
 def save_session():
     from pyncm import GetCurrentSession
     sess = GetCurrentSession()
@@ -19,9 +57,7 @@ def save_session():
         "uid": getattr(sess, 'uid', 0),
         "login_info": getattr(sess, 'login_info', {}),
     }
-    with open(SESSION_FILE, "w") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
-    os.chmod(SESSION_FILE, 0o600)
+    write_json_atomic(SESSION_FILE, data)
 
 def load_session():
     if not os.path.exists(SESSION_FILE):
@@ -43,31 +79,487 @@ def load_session():
         sess.login_info = data["login_info"]
     return True
 
+def read_session_file():
+    if not os.path.exists(SESSION_FILE):
+        return {}
+    with open(SESSION_FILE) as f:
+        return json.load(f)
+
+def update_verified(**fields):
+    """Merge `fields` into the session file's cached login verification;
+    with no fields, drop it."""
+    data = read_session_file()
+    if not data:
+        return
+    data["verified"] = {**data.get("verified", {}), **fields} if fields else {}
+    write_json_atomic(SESSION_FILE, data)
+
+def session_expired():
+    update_verified()
+    print("Session expired. Run: netease.py login <phone>")
+    sys.exit(1)
+
+def check_session(result):
+    """Pass an API result through, bailing out if it says the login is gone."""
+    if isinstance(result, dict) and result.get("code") == 301:
+        session_expired()
+    return result
+
 def require_login():
+    """Load the session and return the account's uid.
+
+    A successful login check is remembered in the session file (uid and
+    timestamp) and trusted for VERIFY_TTL seconds.
+    """
     if not load_session():
         print("Not logged in. Run: netease.py login <phone>")
         sys.exit(1)
+    verified = read_session_file().get("verified") or {}
+    if verified.get("uid") and time.time() - verified.get("at", 0) < VERIFY_TTL:
+        return verified["uid"]
     from pyncm import apis
     try:
         result = apis.login.GetCurrentLoginStatus()
         # Check various response formats
         account = result.get("account") or (result.get("data", {}) or {}).get("account")
         profile = result.get("profile") or (result.get("data", {}) or {}).get("profile")
-        if not account and not profile:
-            print("Session expired. Run: netease.py login <phone>")
-            sys.exit(1)
     except Exception:
-        print("Session expired. Run: netease.py login <phone>")
-        sys.exit(1)
+        account = profile = None
+    if not account and not profile:
+        session_expired()
+    uid = (account or {}).get("id") or (profile or {}).get("userId")
+    if uid != verified.get("uid"):
+        verified = {}
+    update_verified(**{**verified, "uid": uid, "at": time.time()})
+    return uid
+
+def liked_playlist_id(uid):
+    """ID of the account's liked-songs playlist, cached with the login check."""
+    verified = read_session_file().get("verified") or {}
+    if verified.get("uid") == uid and verified.get("liked_playlist"):
+        return verified["liked_playlist"]
+    from pyncm import apis
+    playlists = check_session(apis.user.GetUserPlaylists(uid, limit=1))
+    liked_id = playlists["playlist"][0]["id"]
+    update_verified(liked_playlist=liked_id)
+    return liked_id
+
+def safe_name(text):
+    return "".join(c if c.isalnum() or c in " -_.()" else "_" for c in text)
+
+_host_slots = {}
+_host_slots_lock = threading.Lock()
+
+def host_slot(url):
+    """Semaphore capping concurrent downloads from the URL's host."""
+    host = urllib.parse.urlsplit(url).hostname
+    with _host_slots_lock:
+        return _host_slots.setdefault(host, threading.BoundedSemaphore(HOST_CONCURRENCY))
+
+class Progress:
+    """Aggregate tracks/s and MB/s across download workers.
+
+    A live status line is redrawn on stderr when it's a terminal; per-track
+    lines go through log() so they don't collide with it.
+    """
+    def __init__(self, total):
+        self.total = total
+        self.bytes = 0
+        self.counts = collections.Counter()
+        self.start = time.monotonic()
+        self.lock = threading.Lock()
+        self.live = sys.stderr.isatty()
+        self.stopped = threading.Event()
+        if self.live:
+            threading.Thread(target=self._tick, daemon=True).start()
+
+    def add_bytes(self, n):
+        with self.lock:
+            self.bytes += n
+
+    def finish(self, outcome):
+        with self.lock:
+            self.counts[outcome] += 1
+
+    def status(self):
+        elapsed = max(time.monotonic() - self.start, 1e-6)
+        finished = sum(self.counts.values())
+        return (f"{finished}/{self.total} tracks, {self.counts['ok'] / elapsed:.2f} tracks/s, "
+                f"{self.bytes / elapsed / 1048576:.1f} MB/s")
+
+    def log(self, line):
+        with self.lock:
+            if self.live:
+                sys.stderr.write("\r\033[K")
+            print(line, flush=True)
+
+    def _tick(self):
+        while not self.stopped.wait(0.5):
+            with self.lock:
+                sys.stderr.write("\r" + self.status() + "\033[K")
+                sys.stderr.flush()
+
+    def close(self):
+        """Stop the live line and return a one-line summary."""
+        self.stopped.set()
+        if self.live:
+            sys.stderr.write("\r\033[K")
+        c = self.counts
+        return (f"{c['ok']} downloaded, {c['existing']} already present, "
+                f"{c['skipped']} skipped, {c['failed']} failed "
+                f"in {time.monotonic() - self.start:.1f}s ({self.status()})")
+
+def fetch_to(url, path, progress=None, expected=None):
+    """audio_cache.fetch_to, holding a download slot for the URL's host."""
+    with host_slot(url):
+        return audio_cache.fetch_to(url, path, expected, progress)
+
+def url_expiry(d):
+    """When a GetTrackAudio URL stops working: `expi` seconds from now and/or
+    the yyyyMMddHHmmss (UTC+8) stamp in the CDN path, whichever is sooner;
+    URL_DEFAULT_TTL if neither is there."""
+    candidates = []
+    if d.get("expi"):
+        candidates.append(time.time() + int(d["expi"]))
+    m = re.search(r"/(\d{14})/", d["url"])
+    if m:
+        try:
+            stamp = datetime.strptime(m[1], "%Y%m%d%H%M%S").replace(tzinfo=timezone(timedelta(hours=8)))
+            candidates.append(stamp.timestamp())
+        except ValueError:
+            pass
+    return min(candidates) if candidates else time.time() + URL_DEFAULT_TTL
+
+def _running_command(pid):
+    """Command line of process `pid`, or "" if it isn't running."""
+    try:
+        return subprocess.run(["ps", "-p", str(pid), "-o", "command="], capture_output=True,
+                              text=True).stdout.strip()
+    except OSError:
+        return ""
+
+def stop_player():
+    """Stop whatever the last `play` started, if that player is still running.
 
-def print_tracks(songs, numbered=True):
-    for i, s in enumerate(songs, 1):
+    The pid file records the player's name next to its pid; a pid that now
+    belongs to another program (reused after the player exited) is left alone.
+    """
+    try:
+        with open(PLAY_PID_FILE) as f:
+            pid, name = f.read().split("\n", 1)
+        os.remove(PLAY_PID_FILE)
+        command = _running_command(int(pid)).split()
+        if command and os.path.basename(command[0]) == name.strip():
+            os.killpg(int(pid), signal.SIGTERM)
+    except (OSError, ValueError):
+        pass
+
+def launch_player(argv, **kwargs):
+    """Start a player in its own session, replacing the previous one."""
+    stop_player()
+    proc = subprocess.Popen(argv, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                            start_new_session=True, **kwargs)
+    with open(PLAY_PID_FILE, "w") as f:
+        f.write(f"{proc.pid}\n{os.path.basename(argv[0])}")
+    return proc
+
+def stream_player():
+    return next((argv for argv in STREAM_PLAYERS if shutil.which(argv[0])), None)
+
+def stream_play(url, path, player):
+    """Pipe `url` into `player` as it downloads, also saving it to `path`.
+
+    Returns (seconds to first byte, seconds until the player was fed) as
+    soon as playback can start; a forked child carries on with the rest of
+    the download, and keeps the file for replays even if the player is
+    stopped early.
+    """
+    start = time.monotonic()
+    try:
+        resp = urllib.request.urlopen(url, timeout=DOWNLOAD_TIMEOUT)
+    except urllib.error.HTTPError as e:
+        if e.code in (403, 404):
+            url_cache_invalidate(url)
+        raise
+    first = resp.read1(PRIME_BYTES)  # returns as soon as any body bytes arrive
+    ttfb = time.monotonic() - start
+    if first:
+        first += resp.read(PRIME_BYTES - len(first))
+    proc = launch_player(player, stdin=subprocess.PIPE)
+    proc.stdin.write(first)
+    proc.stdin.flush()
+    started = time.monotonic() - start
+    if os.fork() == 0:
+        os.setsid()
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in (0, 1, 2):
+            os.dup2(devnull, fd)
+        try:
+            feeding = True
+            with open(path + ".part", "wb") as f:
+                f.write(first)
+                while True:
+                    chunk = resp.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    if feeding:
+                        try:
+                            proc.stdin.write(chunk)
+                        except BrokenPipeError:
+                            feeding = False
+            os.replace(path + ".part", path)
+        except Exception:
+            pass
+        os._exit(0)
+    return ttfb, started
+
+def resolve_audio(track_ids, bitrate=320000, ladder=True):
+    """Map track id -> GetTrackAudio entry that has a URL, AUDIO_BATCH ids per request.
+
+    Tracks without a URL at `bitrate` are retried at each lower step of
+    BITRATE_LADDER (unless `ladder` is false); ids missing from the result
+    have no URL at all. URLs are cached under the step that produced them,
+    and each step reuses cached URLs before asking GetTrackAudio. A ladder
+    lookup's outcome is also cached under the requested bitrate (as
+    "netease-ladder"), so replaying a track that fell back costs no
+    requests, while `ladder=False` still only sees exact-step URLs.
+    """
+    from pyncm import apis
+    pending = list(dict.fromkeys(track_ids))
+    found = url_cache_get("netease-ladder", pending, bitrate) if ladder else {}
+    pending = [t for t in pending if t not in found]
+    cached = set(found)
+    steps = [bitrate] + ([b for b in BITRATE_LADDER if b < bitrate] if ladder else [])
+    for br in steps:
+        if not pending:
+            break
+        found.update(url_cache_get("netease", pending, br))
+        pending = [t for t in pending if t not in found]
+        fetched = {}
+        for i in range(0, len(pending), AUDIO_BATCH):
+            audio = check_session(apis.track.GetTrackAudio(pending[i:i + AUDIO_BATCH], bitrate=br))
+            for d in audio.get("data", []):
+                if d.get("url"):
+                    fetched[d["id"]] = d
+        if fetched:
+            url_cache_put("netease", br, {tid: (d, url_expiry(d)) for tid, d in fetched.items()})
+            found.update(fetched)
+        pending = [t for t in pending if t not in found]
+    if ladder:
+        url_cache_put("netease-ladder", bitrate,
+                      {tid: (d, url_expiry(d)) for tid, d in found.items() if tid not in cached})
+    return found
+
+def hydrate_tracks(track_ids):
+    """Track details for `track_ids`, in order; ids the API doesn't know are dropped.
+
+    Details are cached on disk by id (TRACK_CACHE), so playlists sharing
+    songs don't refetch them. The rest are fetched DETAIL_BATCH ids per
+    request, DETAIL_CONCURRENCY requests at a time.
+    """
+    from pyncm import apis
+    db = sqlite3.connect(TRACK_CACHE)
+    db.execute("CREATE TABLE IF NOT EXISTS tracks (id INTEGER PRIMARY KEY, fetched_at REAL, song TEXT)")
+    found = {}
+    ids = list(dict.fromkeys(track_ids))
+    fresh_after = time.time() - TRACK_CACHE_TTL
+    for i in range(0, len(ids), 900):   # stay under SQLite's bound-parameter limit
+        chunk = ids[i:i + 900]
+        rows = db.execute(
+            f"SELECT id, song FROM tracks WHERE fetched_at > ? AND id IN ({','.join('?' * len(chunk))})",
+            [fresh_after, *chunk])
+        found.update((tid, json.loads(song)) for tid, song in rows)
+    missing = [tid for tid in ids if tid not in found]
+    batches = [missing[i:i + DETAIL_BATCH] for i in range(0, len(missing), DETAIL_BATCH)]
+    with ThreadPoolExecutor(DETAIL_CONCURRENCY) as pool:
+        for detail in pool.map(apis.track.GetTrackDetail, batches):
+            songs = detail.get("songs", [])
+            found.update((song["id"], song) for song in songs)
+            db.executemany("INSERT OR REPLACE INTO tracks VALUES (?, ?, ?)",
+                           [(song["id"], time.time(), json.dumps(song, ensure_ascii=False)) for song in songs])
+    db.commit()
+    db.close()
+    return [found[tid] for tid in track_ids if tid in found]
+
+def playlist_tracks(playlist, limit=None):
+    """A GetPlaylistInfo playlist's tracks in order, hydrated from trackIds
+    when the inline `tracks` list is missing or shorter than the playlist."""
+    tracks = playlist.get("tracks") or []
+    track_ids = [t["id"] for t in playlist.get("trackIds", [])]
+    if limit is not None:
+        tracks, track_ids = tracks[:limit], track_ids[:limit]
+    if len(track_ids) <= len(tracks):
+        return tracks
+    return hydrate_tracks(track_ids)
+
+def save_track(track, out_dir, bitrate=320000):
+    """Download one track as `name - artists.ext` in `out_dir`.
+
+    Returns (path, bytes transferred or None if already complete); raises
+    LookupError if the track has no audio URL.
+    """
+    audio = resolve_audio([track["id"]], bitrate).get(track["id"])
+    if not audio:
+        raise LookupError("No audio URL available. Track may require VIP or is region-locked.")
+    artists = "/".join(a["name"] for a in track.get("ar", track.get("artists", [])))
+    name = track.get("name", "unknown")
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, f"{safe_name(f'{name} - {artists}')}.{audio.get('type') or 'mp3'}")
+    return path, fetch_to(audio["url"], path, expected=audio.get("size"))
+
+def search_songs(query, limit=20):
+    """Yield up to `limit` distinct songs for `query`.
+
+    Pages of SEARCH_PAGE results are fetched SEARCH_CONCURRENCY at a time;
+    each page's songs are yielded as soon as it and the pages before it
+    have arrived.
+    """
+    from pyncm import apis
+    size = min(limit, SEARCH_PAGE)
+
+    def page(offset):
+        result = apis.cloudsearch.GetSearchResult(query, limit=size, offset=offset)
+        return result.get("result", {}).get("songs", [])
+
+    seen = set()
+    with ThreadPoolExecutor(SEARCH_CONCURRENCY) as pool:
+        for songs in pool.map(page, range(0, limit, size)):
+            for song in songs:
+                if song["id"] not in seen:
+                    seen.add(song["id"])
+                    yield song
+                    if len(seen) >= limit:
+                        return
+            if len(songs) < size:   # past the last result
+                return
+
+def print_tracks(songs, numbered=True, start=1):
+    for i, s in enumerate(songs, start):
         artists = "/".join(a["name"] for a in s.get("ar", s.get("artists", [])))
         name = s.get("name", "?")
         sid = s.get("id", "?")
         prefix = f"{i}. " if numbered else ""
         print(f"{prefix}{name} — {artists} (id:{sid})")
 
+# --- Worker mode: line-delimited JSON-RPC 2.0 over stdio or a Unix socket ---
+
+def song_summary(s):
+    return {
+        "id": s.get("id"),
+        "name": s.get("name"),
+        "artists": [a["name"] for a in s.get("ar", s.get("artists", []))],
+        "album": (s.get("al") or s.get("album") or {}).get("name"),
+        "duration_ms": s.get("dt", s.get("duration")),
+    }
+
+def rpc_search(query, limit=20):
+    if int(limit) < 1:
+        raise TypeError("limit must be at least 1")
+    return [song_summary(s) for s in search_songs(query, limit)]
+
+def rpc_playlist(id, limit=None):
+    from pyncm import apis
+    playlist = apis.playlist.GetPlaylistInfo(int(id)).get("playlist", {})
+    tracks = playlist_tracks(playlist, limit)
+    return {"id": playlist.get("id"), "name": playlist.get("name"),
+            "tracks": [song_summary(t) for t in tracks]}
+
+def rpc_url(id=None, ids=None, bitrate=320000):
+    """URL info for one id, or a dict of id -> info (null if unavailable) for `ids`."""
+    require_login()
+    wanted = [int(i) for i in (ids if ids is not None else [id])]
+    found = resolve_audio(wanted, bitrate)
+    info = {tid: {"url": a["url"], "bitrate": a.get("br"), "type": a.get("type"), "size": a.get("size")}
+            for tid, a in found.items()}
+    if ids is None:
+        return info.get(wanted[0])
+    return {str(tid): info.get(tid) for tid in wanted}
+
+def rpc_download(id, dir=".", bitrate=320000):
+    require_login()
+    tracks = hydrate_tracks([int(id)])
+    if not tracks:
+        raise LookupError(f"Unknown track: {id}")
+    path, transferred = save_track(tracks[0], dir, bitrate)
+    return {"path": os.path.abspath(path), "bytes": os.path.getsize(path),
+            "already_downloaded": transferred is None}
+
+RPC_METHODS = {"search": rpc_search, "playlist": rpc_playlist, "url": rpc_url, "download": rpc_download}
+
+def rpc_handle(line):
+    """Response dict for one request line, or None for a notification."""
+    try:
+        req = json.loads(line)
+    except ValueError:
+        return {"jsonrpc": "2.0", "id": None, "error": {"code": -32700, "message": "Parse error"}}
+    if not isinstance(req, dict):
+        return {"jsonrpc": "2.0", "id": None, "error": {"code": -32600, "message": "Invalid request"}}
+    reply = {"jsonrpc": "2.0", "id": req.get("id")}
+    method = RPC_METHODS.get(req.get("method"))
+    params = req.get("params") or {}
+    try:
+        if not method:
+            reply["error"] = {"code": -32601, "message": f"Unknown method: {req.get('method')}"}
+        else:
+            reply["result"] = method(**params) if isinstance(params, dict) else method(*params)
+    except TypeError as e:
+        reply["error"] = {"code": -32602, "message": str(e)}
+    except SystemExit:
+        reply["error"] = {"code": -32001, "message": "Not logged in or session expired"}
+    except Exception as e:
+        reply["error"] = {"code": -32000, "message": f"{type(e).__name__}: {e}"}
+    return reply if "id" in req else None
+
+class RPCHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if line.strip():
+                reply = rpc_handle(line)
+                if reply:
+                    self.wfile.write(json.dumps(reply, ensure_ascii=False).encode() + b"\n")
+
+class RPCServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def serve(socket_path=None):
+    """Answer JSON-RPC requests, one per line, keeping the pyncm session warm."""
+    out = sys.stdout
+    sys.stdout = sys.stderr   # helpers print; only replies may reach the protocol stream
+    load_session()
+    if not socket_path:
+        for line in sys.stdin:
+            if line.strip():
+                reply = rpc_handle(line)
+                if reply:
+                    out.write(json.dumps(reply, ensure_ascii=False) + "\n")
+                    out.flush()
+        return
+    if os.path.exists(socket_path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(socket_path)
+        except OSError:
+            os.remove(socket_path)  # left behind by a worker that died
+        else:
+            print(f"Already running: {socket_path}")
+            sys.exit(1)
+        finally:
+            probe.close()
+    old_umask = os.umask(0o077)  # socket is 0600 from the moment it exists
+    try:
+        server = RPCServer(socket_path, RPCHandler)
+    finally:
+        os.umask(old_umask)
+    with server:
+        print(f"Serving JSON-RPC on {socket_path}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.remove(socket_path)
+
 if __name__ == "__main__":
     cmd = sys.argv[1] if len(sys.argv) > 1 else "help"
 
@@ -146,30 +638,39 @@ if __name__ == "__main__":
             profile = result.get("profile") or (result.get("data", {}) or {}).get("profile")
             if profile:
                 print(f"Logged in as: {profile.get('nickname')} (uid: {profile.get('userId')})")
+                update_verified(uid=profile.get("userId"), at=time.time())
             else:
+                update_verified()
                 print("Session expired.")
         except Exception:
+            update_verified()
             print("Session expired.")
 
     elif cmd == "search":
-        from pyncm import apis
-        query = " ".join(sys.argv[2:])
-        if not query:
-            print("Usage: netease.py search <query>")
+        args = sys.argv[2:]
+        limit = 20
+        if "--limit" in args:
+            idx = args.index("--limit")
+            try:
+                limit = int(args[idx + 1])
+            except (IndexError, ValueError):
+                limit = 0
+            del args[idx:idx + 2]
+        query = " ".join(args)
+        if not query or limit < 1:
+            print("Usage: netease.py search <query> [--limit N]")
             sys.exit(1)
-        result = apis.cloudsearch.GetSearchResult(query, limit=20)
-        songs = result.get("result", {}).get("songs", [])
-        if songs:
-            print_tracks(songs)
-        else:
+        found = 0
+        for found, song in enumerate(search_songs(query, limit), 1):
+            print_tracks([song], start=found)
+            sys.stdout.flush()
+        if not found:
             print("No results.")
 
     elif cmd == "playlists":
-        require_login()
+        uid = require_login()
         from pyncm import apis
-        status = apis.login.GetCurrentLoginStatus()
-        uid = status.get("data", {}).get("account", {}).get("id", 0)
-        result = apis.user.GetUserPlaylists(uid, limit=50)
+        result = check_session(apis.user.GetUserPlaylists(uid, limit=50))
         for i, p in enumerate(result.get("playlist", []), 1):
             count = p.get("trackCount", "?")
             print(f"{i}. {p['name']} ({count} tracks) — id:{p['id']}")
@@ -182,23 +683,18 @@ if __name__ == "__main__":
         pid = int(sys.argv[2])
         result = apis.playlist.GetPlaylistInfo(pid)
         playlist = result.get("playlist", {})
-        tracks = playlist.get("tracks", [])
+        tracks = playlist_tracks(playlist)
         if tracks:
             print(f"「{playlist.get('name', '?')}」- {len(tracks)} tracks\n")
             print_tracks(tracks)
         else:
-            track_ids = [t["id"] for t in playlist.get("trackIds", [])]
-            if track_ids:
-                detail = apis.track.GetTrackDetail(track_ids[:100])
-                print_tracks(detail.get("songs", []))
-            else:
-                print("Empty playlist.")
+            print("Empty playlist.")
 
     elif cmd == "recent":
         require_login()
         from pyncm import apis
         limit = int(sys.argv[2]) if len(sys.argv) > 2 else 50
-        result = apis.user.GetRecentPlaylist()
+        result = check_session(apis.user.GetRecentPlaylist())
         songs_data = result.get("data", {}).get("list", [])
         for i, item in enumerate(songs_data[:limit], 1):
             resource = item.get("resourceId", "")
@@ -206,21 +702,10 @@ if __name__ == "__main__":
             print(f"{i}. {name} (id:{resource})")
 
     elif cmd == "likes":
-        require_login()
+        uid = require_login()
         from pyncm import apis
-        status = apis.login.GetCurrentLoginStatus()
-        uid = status.get("data", {}).get("account", {}).get("id", 0)
-        playlists = apis.user.GetUserPlaylists(uid, limit=1)
-        liked_id = playlists["playlist"][0]["id"]
-        result = apis.playlist.GetPlaylistInfo(liked_id)
-        tracks = result.get("playlist", {}).get("tracks", [])
-        if tracks:
-            print_tracks(tracks[:50])
-        else:
-            track_ids = [t["id"] for t in result.get("playlist", {}).get("trackIds", [])][:50]
-            if track_ids:
-                detail = apis.track.GetTrackDetail(track_ids)
-                print_tracks(detail.get("songs", []))
+        result = check_session(apis.playlist.GetPlaylistInfo(liked_playlist_id(uid)))
+        print_tracks(playlist_tracks(result.get("playlist", {}), limit=50))
 
     elif cmd == "url":
         require_login()
@@ -230,17 +715,15 @@ if __name__ == "__main__":
             sys.exit(1)
         track_id = int(sys.argv[2])
         bitrate = int(sys.argv[3]) if len(sys.argv) > 3 else 320000
-        result = apis.track.GetTrackAudio([track_id], bitrate=bitrate)
-        for d in result.get("data", []):
-            if d.get("url"):
-                print(d["url"])
-            else:
-                print(f"No URL available (code: {d.get('code')}, fee: {d.get('fee')})")
+        audio = resolve_audio([track_id], bitrate, ladder=False).get(track_id)
+        if audio:
+            print(audio["url"])
+        else:
+            print("No URL available (VIP-only or region-locked).")
 
     elif cmd == "download":
         require_login()
         from pyncm import apis
-        import urllib.request
         if len(sys.argv) < 3:
             print("Usage: netease.py download <track_id|search query> [output_dir]")
             sys.exit(1)
@@ -248,8 +731,7 @@ if __name__ == "__main__":
         # Check if arg is a number (track ID) or search query
         try:
             track_id = int(sys.argv[2])
-            detail = apis.track.GetTrackDetail([track_id])
-            track = detail["songs"][0]
+            track = hydrate_tracks([track_id])[0]
         except ValueError:
             query = " ".join(sys.argv[2:])
             sr = apis.cloudsearch.GetSearchResult(query, limit=1)
@@ -264,33 +746,23 @@ if __name__ == "__main__":
         name = track.get("name", "unknown")
         print(f"Downloading: {name} — {artists}")
 
-        audio = apis.track.GetTrackAudio([track_id], bitrate=320000)
-        url = None
-        ext = "mp3"
-        for d in audio.get("data", []):
-            if d.get("url"):
-                url = d["url"]
-                ext = d.get("type", "mp3")
-                break
-        if not url:
-            print("No audio URL available. Track may require VIP or is region-locked.")
-            sys.exit(1)
-
         out_dir = sys.argv[3] if len(sys.argv) > 3 and not sys.argv[3].startswith("-") else "."
-        os.makedirs(out_dir, exist_ok=True)
-        safe_name = "".join(c if c.isalnum() or c in " -_.()" else "_" for c in f"{name} - {artists}")
-        out_path = os.path.join(out_dir, f"{safe_name}.{ext}")
-
-        urllib.request.urlretrieve(url, out_path)
+        try:
+            out_path, transferred = save_track(track, out_dir)
+        except LookupError as e:
+            print(e)
+            sys.exit(1)
+        if transferred is None:
+            print(f"Already downloaded: {out_path}")
+            sys.exit(0)
         size_mb = os.path.getsize(out_path) / 1024 / 1024
         print(f"Saved: {out_path} ({size_mb:.1f} MB)")
 
     elif cmd == "download-playlist":
         require_login()
         from pyncm import apis
-        import urllib.request
         if len(sys.argv) < 3:
-            print("Usage: netease.py download-playlist <playlist_id> [output_dir] [--limit N]")
+            print("Usage: netease.py download-playlist <playlist_id> [output_dir] [--limit N] [--bitrate N]")
             sys.exit(1)
         pid = int(sys.argv[2])
         out_dir = sys.argv[3] if len(sys.argv) > 3 and not sys.argv[3].startswith("-") else "."
@@ -298,50 +770,53 @@ if __name__ == "__main__":
         if "--limit" in sys.argv:
             idx = sys.argv.index("--limit")
             limit = int(sys.argv[idx + 1])
+        bitrate = 320000
+        if "--bitrate" in sys.argv:
+            bitrate = int(sys.argv[sys.argv.index("--bitrate") + 1])
 
         result = apis.playlist.GetPlaylistInfo(pid)
         playlist = result.get("playlist", {})
-        tracks = playlist.get("tracks", [])
-        if not tracks:
-            track_ids = [t["id"] for t in playlist.get("trackIds", [])][:limit]
-            if track_ids:
-                detail = apis.track.GetTrackDetail(track_ids)
-                tracks = detail.get("songs", [])
-        tracks = tracks[:limit]
+        tracks = playlist_tracks(playlist, limit)
 
         pname = "".join(c if c.isalnum() or c in " -_()" else "_" for c in playlist.get("name", "playlist"))
         out_dir = os.path.join(out_dir, pname)
         os.makedirs(out_dir, exist_ok=True)
         print(f"Downloading「{playlist.get('name')}」→ {out_dir}\n")
 
-        for i, t in enumerate(tracks, 1):
+        # Resolve every URL up front in a few batched requests, then download
+        urls = resolve_audio([t["id"] for t in tracks], bitrate)
+
+        def download_track(i, t):
             artists = "/".join(a["name"] for a in t.get("ar", []))
             name = t.get("name", "?")
-            audio = apis.track.GetTrackAudio([t["id"]], bitrate=320000)
-            url = None
-            ext = "mp3"
-            for d in audio.get("data", []):
-                if d.get("url"):
-                    url = d["url"]
-                    ext = d.get("type", "mp3")
-                    break
-            if not url:
-                print(f"{i}. SKIP (no URL): {name} — {artists}")
-                continue
-            safe = "".join(c if c.isalnum() or c in " -_.()" else "_" for c in f"{name} - {artists}")
-            path = os.path.join(out_dir, f"{i:02d}. {safe}.{ext}")
-            try:
-                urllib.request.urlretrieve(url, path)
-                size = os.path.getsize(path) / 1024 / 1024
-                print(f"{i}. {name} — {artists} ({size:.1f} MB)")
-            except Exception as e:
-                print(f"{i}. FAILED: {name} — {e}")
-
-        print(f"\nDone! Files in: {out_dir}")
+            audio = urls.get(t["id"])
+            if not audio:
+                return "skipped", f"{i}. SKIP (no URL): {name} — {artists}"
+            url, ext = audio["url"], audio.get("type") or "mp3"
+            path = os.path.join(out_dir, f"{i:02d}. {safe_name(f'{name} - {artists}')}.{ext}")
+            if fetch_to(url, path, progress, audio.get("size")) is None:
+                return "existing", f"{i}. {name} — {artists} (already downloaded)"
+            size = os.path.getsize(path) / 1024 / 1024
+            return "ok", f"{i}. {name} — {artists} ({size:.1f} MB)"
+
+        # Tracks download concurrently (capped per host); lines print as each finishes
+        progress = Progress(len(tracks))
+        with ThreadPoolExecutor(DOWNLOAD_WORKERS) as pool:
+            futures = {pool.submit(download_track, i, t): (i, t) for i, t in enumerate(tracks, 1)}
+            for future in as_completed(futures):
+                i, t = futures[future]
+                try:
+                    outcome, line = future.result()
+                except Exception as e:
+                    outcome, line = "failed", f"{i}. FAILED: {t.get('name', '?')} — {e}"
+                progress.finish(outcome)
+                progress.log(line)
+
+        print(f"\n{progress.close()}")
+        print(f"Files in: {out_dir}")
 
     elif cmd == "play":
-        # Search → download to temp → afplay
-        import subprocess, tempfile, urllib.request
+        # Search → stream into mpv/ffplay (or download, then afplay)
         if len(sys.argv) < 3:
             print("Usage: netease.py play <query|track_id>")
             sys.exit(1)
@@ -351,8 +826,7 @@ if __name__ == "__main__":
         try:
             track_id = int(sys.argv[2])
             # Lookup track info
-            detail = apis.track.GetTrackDetail([track_id])
-            songs = detail.get("songs", [])
+            songs = hydrate_tracks([track_id])
             if songs:
                 name = songs[0].get("name", "?")
                 artists = "/".join(a["name"] for a in songs[0].get("ar", []))
@@ -369,21 +843,36 @@ if __name__ == "__main__":
             name = songs[0].get("name", "?")
             artists = "/".join(a["name"] for a in songs[0].get("ar", []))
 
-        # Get audio URL
-        audio = apis.track.GetTrackAudio([track_id], bitrate=320000)
-        audio_url = (audio.get("data", [{}])[0] or {}).get("url")
-        if not audio_url:
+        audio = resolve_audio([track_id]).get(track_id)
+        if not audio:
             print(f"No audio URL for: {name} — may be VIP-only.")
             sys.exit(1)
+        audio_url = audio["url"]
 
         print(f"Playing: {name} — {artists}")
-        # Download to temp and play in background
-        ext = "mp3" if ".mp3" in audio_url else "m4a"
-        tmp = os.path.join(tempfile.gettempdir(), f"ears-play.{ext}")
-        urllib.request.urlretrieve(audio_url, tmp)
-        # Kill any previous afplay
-        subprocess.run(["pkill", "-f", "afplay.*ears-play"], capture_output=True)
-        subprocess.Popen(["nohup", "afplay", tmp], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+        ext = audio.get("type") or ("mp3" if ".mp3" in audio_url else "m4a")
+        path = os.path.join(tempfile.gettempdir(), f"ears-play-{track_id}.{ext}")
+        player = stream_player()
+        if os.path.exists(path) and os.path.getsize(path) == audio.get("size"):
+            launch_player(player[:-1] + [path] if player else ["afplay", path])
+            print("(from local copy)")
+        elif player:
+            ttfb, started = stream_play(audio_url, path, player)
+            print(f"(first byte {ttfb * 1000:.0f} ms, playback {started * 1000:.0f} ms, {player[0]})")
+        else:
+            # afplay can't read a growing stream: download first
+            start = time.monotonic()
+            fetch_to(audio_url, path, expected=audio.get("size"))
+            launch_player(["afplay", path])
+            print(f"(playback {(time.monotonic() - start) * 1000:.0f} ms after full download, afplay)")
+
+    elif cmd == "serve":
+        if "--socket" in sys.argv:
+            idx = sys.argv.index("--socket")
+            path = sys.argv[idx + 1] if idx + 1 < len(sys.argv) else WORKER_SOCKET
+            serve(path)
+        else:
+            serve()
 
     elif cmd == "play-mac":
         import subprocess
@@ -428,7 +917,7 @@ Auth:
   status                    Check login status
 
 Browse:
-  search <query>            Search songs
+  search <query> [--limit N]  Search songs (default 20; pages fetched in parallel)
   playlists                 Your playlists
   playlist <id>             Tracks in a playlist
   recent                    Recently played
@@ -437,7 +926,11 @@ Browse:
 Audio:
   url <track_id> [bitrate]  Get audio URL
   download <id|query> [dir] Download a track
-  download-playlist <id> [dir] [--limit N]  Download playlist
+  download-playlist <id> [dir] [--limit N] [--bitrate N]  Download playlist
+
+Worker:
+  serve [--socket [PATH]]   JSON-RPC over stdin/stdout (or a Unix socket):
+                            search, playlist, url, download
 
 Playback (macOS desktop app):
   play-mac toggle           Play/pause
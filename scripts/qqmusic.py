@@ -1,30 +1,163 @@
 #!/usr/bin/env python3
 """QQ Music CLI for OpenClaw — direct API calls."""
-import json, sys, os, urllib.request, urllib.parse
+import json, sys, os, re, time, codecs, urllib.request, urllib.parse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from audio_cache import url_cache_get, url_cache_put, fetch_to
 
 CONFIG_DIR = os.path.expanduser("~/.config/openclaw-ears")
 COOKIE_FILE = os.path.join(CONFIG_DIR, "qqmusic-cookie.txt")
 os.makedirs(CONFIG_DIR, exist_ok=True)
 
+URL_DEFAULT_TTL = 600    # when the vkey response doesn't say how long it lasts
+VKEY_BATCH = 100         # songmids per CgiGetVkey sub-request
+DOWNLOAD_WORKERS = 8
+SEARCH_PAGE = 50         # results per search request
+SEARCH_CONCURRENCY = 4
+READ_CHUNK = 64 * 1024
+
 BASE_HEADERS = {
     "Referer": "https://y.qq.com",
     "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36",
 }
 
-def api_call(module, method, param, cookie=None):
-    """Call QQ Music unified API."""
-    payload = json.dumps({
-        "comm": {"ct": 19, "cv": 1859},
-        "req": {"module": module, "method": method, "param": param}
-    })
+def api_batch(calls, cookie=None):
+    """Call several QQ Music unified API methods in one musicu.fcg request.
+
+    `calls` is a list of (module, method, param). Returns one
+    {"code": int, "data": dict} per call, in order; a non-zero code means
+    only that sub-request failed.
+    """
+    payload = {"comm": {"ct": 19, "cv": 1859}}
+    for i, (module, method, param) in enumerate(calls):
+        payload[f"req_{i}"] = {"module": module, "method": method, "param": param}
     req = urllib.request.Request(
         "https://u.y.qq.com/cgi-bin/musicu.fcg",
-        data=payload.encode(),
+        data=json.dumps(payload).encode(),
         headers={**BASE_HEADERS, "Content-Type": "application/json",
                  **({"Cookie": cookie} if cookie else {})}
     )
     data = json.loads(urllib.request.urlopen(req, timeout=15).read())
-    return data.get("req", {}).get("data", {})
+    results = []
+    for i in range(len(calls)):
+        sub = data.get(f"req_{i}") or {}
+        results.append({"code": sub.get("code", data.get("code", -1)), "data": sub.get("data") or {}})
+    return results
+
+def api_call(module, method, param, cookie=None):
+    """Call QQ Music unified API."""
+    return api_batch([(module, method, param)], cookie)[0]["data"]
+
+def vkey_request(mids):
+    """api_batch call resolving stream URLs for `mids`."""
+    return (
+        "vkey.GetVkeyServer",
+        "CgiGetVkey",
+        {
+            "guid": "1234567890",
+            "songmid": list(mids),
+            "songtype": [0] * len(mids),
+            "uin": "0",
+            "loginflag": 1,
+            "platform": "20"
+        },
+    )
+
+def cache_vkey_urls(data):
+    """{songmid: url} from a CgiGetVkey response, saved in the URL cache until
+    the vkey's `expiration` (URL_DEFAULT_TTL if not given). Songs without a
+    URL (usually VIP-only) are left out."""
+    sip = (data.get("sip") or ["https://ws.stream.qqmusic.qq.com/"])[0]
+    urls = {i["songmid"]: f"{sip}{i['purl']}" for i in data.get("midurlinfo", []) if i.get("purl")}
+    expires_at = time.time() + (data.get("expiration") or URL_DEFAULT_TTL)
+    if urls:
+        url_cache_put("qq", 0, {mid: ({"url": url}, expires_at) for mid, url in urls.items()})
+    return urls
+
+def vkey_url(mid, cookie=None):
+    """Signed audio URL for a songmid, or None (usually VIP-only)."""
+    cached = url_cache_get("qq", [mid], 0).get(mid)
+    if cached:
+        return cached["url"]
+    return cache_vkey_urls(api_call(*vkey_request([mid]), cookie)).get(mid)
+
+def resolve_vkey_urls(mids, cookie=None):
+    """{songmid: url} for many songs; songs without a URL are left out.
+
+    Cached URLs are reused; the rest are resolved VKEY_BATCH mids per
+    CgiGetVkey sub-request, all sent in one api_batch request.
+    """
+    found = {mid: info["url"] for mid, info in url_cache_get("qq", mids, 0).items()}
+    pending = [mid for mid in dict.fromkeys(mids) if mid not in found]
+    chunks = [pending[i:i + VKEY_BATCH] for i in range(0, len(pending), VKEY_BATCH)]
+    if chunks:
+        for result in api_batch([vkey_request(chunk) for chunk in chunks], cookie):
+            if result["code"] == 0:
+                found.update(cache_vkey_urls(result["data"]))
+    return found
+
+def _playlist_meta(text):
+    """dissname/songnum from the part of the response before songlist."""
+    name = re.search(r'"dissname"\s*:\s*("(?:[^"\\]|\\.)*")', text)
+    num = re.search(r'"(?:cur_song_num|songnum)"\s*:\s*(\d+)', text)
+    return {"name": json.loads(name.group(1)) if name else "?",
+            "songnum": int(num.group(1)) if num else None}
+
+def _slim_song(s):
+    """The songlist fields we print or export."""
+    return {"songname": s.get("songname"), "songmid": s.get("songmid"),
+            "singer": [{"name": x.get("name")} for x in s.get("singer", [])],
+            "interval": s.get("interval")}
+
+def _iter_songlist(resp, decoder, buf):
+    # Decode one songlist entry at a time, reading more only when the next
+    # entry isn't complete yet; consumed text is dropped as we go
+    parser = json.JSONDecoder()
+    pos = 0
+    with resp:
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if buf[pos:pos + 1] == "]":
+                return
+            if pos < len(buf):
+                try:
+                    song, pos = parser.raw_decode(buf, pos)
+                    yield _slim_song(song)
+                    continue
+                except ValueError:
+                    pass
+            chunk = resp.read(READ_CHUNK)
+            if not chunk:
+                raise ValueError("playlist response ended mid-songlist")
+            buf = buf[pos:] + decoder.decode(chunk)
+            pos = 0
+
+def open_playlist(pid, cookie=None):
+    """Start streaming a playlist (disstid).
+
+    Returns ({"name", "songnum"}, songs) as soon as the songlist begins;
+    `songs` yields slimmed entries as the response arrives, so memory stays
+    flat however long the playlist is.
+    """
+    url = f"https://c.y.qq.com/qzone/fcg-bin/fcg_ucc_getcdinfo_byids_cp.fcg?disstid={pid}&type=1&json=1&utf8=1&format=json"
+    req = urllib.request.Request(url, headers={**BASE_HEADERS, "Cookie": cookie or ""})
+    resp = urllib.request.urlopen(req, timeout=15)
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    buf = ""
+    while True:
+        start = re.search(r'"songlist"\s*:\s*\[', buf)
+        if start:
+            return _playlist_meta(buf[:start.start()]), _iter_songlist(resp, decoder, buf[start.end():])
+        chunk = resp.read(READ_CHUNK)
+        if not chunk:
+            resp.close()
+            return _playlist_meta(buf), iter(())
+        buf += decoder.decode(chunk)
+
+def fetch_playlist(pid, cookie=None):
+    """(name, songlist) for a playlist (disstid)."""
+    meta, songs = open_playlist(pid, cookie)
+    return meta["name"], list(songs)
 
 def load_cookie():
     if os.path.exists(COOKIE_FILE):
@@ -39,8 +172,37 @@ def require_cookie():
         sys.exit(1)
     return cookie
 
-def print_tracks(songs, numbered=True):
-    for i, s in enumerate(songs, 1):
+def search_songs(query, limit=20):
+    """Yield up to `limit` distinct songs for `query`.
+
+    Pages of SEARCH_PAGE results are fetched SEARCH_CONCURRENCY at a time;
+    each page's songs are yielded as soon as it and the pages before it
+    have arrived.
+    """
+    size = min(limit, SEARCH_PAGE)
+
+    def page(num):
+        data = api_call(
+            "music.search.SearchCgiService",
+            "DoSearchForQQMusicDesktop",
+            {"num_per_page": size, "page_num": num, "query": query, "search_type": 0}
+        )
+        return data.get("body", {}).get("song", {}).get("list", [])
+
+    seen = set()
+    with ThreadPoolExecutor(SEARCH_CONCURRENCY) as pool:
+        for songs in pool.map(page, range(1, -(-limit // size) + 1)):
+            for song in songs:
+                if song.get("mid") not in seen:
+                    seen.add(song.get("mid"))
+                    yield song
+                    if len(seen) >= limit:
+                        return
+            if len(songs) < size:   # past the last result
+                return
+
+def print_tracks(songs, numbered=True, start=1):
+    for i, s in enumerate(songs, start):
         singers = "/".join(x["name"] for x in s.get("singer", []))
         name = s.get("name", s.get("songname", "?"))
         mid = s.get("mid", s.get("songmid", "?"))
@@ -159,17 +321,22 @@ if __name__ == "__main__":
                 print(f"Session may be expired: {e}")
 
     elif cmd == "search":
-        query = " ".join(sys.argv[2:])
-        if not query:
-            print("Usage: qqmusic.py search <query>")
+        args = sys.argv[2:]
+        limit = 20
+        if "--limit" in args:
+            idx = args.index("--limit")
+            try:
+                limit = int(args[idx + 1])
+            except (IndexError, ValueError):
+                limit = 0
+            del args[idx:idx + 2]
+        query = " ".join(args)
+        if not query or limit < 1:
+            print("Usage: qqmusic.py search <query> [--limit N]")
             sys.exit(1)
-        data = api_call(
-            "music.search.SearchCgiService",
-            "DoSearchForQQMusicDesktop",
-            {"num_per_page": 20, "page_num": 1, "query": query, "search_type": 0}
-        )
-        songs = data.get("body", {}).get("song", {}).get("list", [])
-        print_tracks(songs)
+        for i, song in enumerate(search_songs(query, limit), 1):
+            print_tracks([song], start=i)
+            sys.stdout.flush()
 
     elif cmd == "search-albums":
         query = " ".join(sys.argv[2:])
@@ -209,17 +376,61 @@ if __name__ == "__main__":
             sys.exit(1)
         pid = sys.argv[2]
         cookie = load_cookie() or ""
-        url = f"https://c.y.qq.com/qzone/fcg-bin/fcg_ucc_getcdinfo_byids_cp.fcg?disstid={pid}&type=1&json=1&utf8=1&format=json"
-        req = urllib.request.Request(url, headers={**BASE_HEADERS, "Cookie": cookie})
-        data = json.loads(urllib.request.urlopen(req, timeout=15).read())
-        cdlist = data.get("cdlist", [{}])
-        if cdlist:
-            cd = cdlist[0]
-            songs = cd.get("songlist", [])
-            print(f"「{cd.get('dissname', '?')}」— {len(songs)} tracks\n")
-            for i, s in enumerate(songs, 1):
-                singers = "/".join(x["name"] for x in s.get("singer", []))
-                print(f"{i}. {s.get('songname', '?')} — {singers} (mid:{s.get('songmid', '?')})")
+        meta, songs = open_playlist(pid, cookie)
+        print(f"「{meta['name']}」— {meta['songnum'] if meta['songnum'] is not None else '?'} tracks\n")
+        for i, s in enumerate(songs, 1):
+            singers = "/".join(x["name"] for x in s.get("singer", []))
+            print(f"{i}. {s.get('songname') or '?'} — {singers} (mid:{s.get('songmid') or '?'})", flush=True)
+
+    elif cmd == "download-playlist":
+        if len(sys.argv) < 3:
+            print("Usage: qqmusic.py download-playlist <disstid> [output_dir] [--limit N]")
+            sys.exit(1)
+        pid = sys.argv[2]
+        out_dir = sys.argv[3] if len(sys.argv) > 3 and not sys.argv[3].startswith("-") else "."
+        limit = int(sys.argv[sys.argv.index("--limit") + 1]) if "--limit" in sys.argv else None
+        cookie = load_cookie() or ""
+
+        dissname, songs = fetch_playlist(pid, cookie)
+        songs = songs[:limit]
+        out_dir = os.path.join(out_dir, "".join(c if c.isalnum() or c in " -_()" else "_" for c in dissname))
+        os.makedirs(out_dir, exist_ok=True)
+        print(f"Downloading「{dissname}」→ {out_dir}\n")
+
+        # All stream URLs up front (a few songmids-per-request vkey calls), then download
+        urls = resolve_vkey_urls([s["songmid"] for s in songs if s.get("songmid")], cookie)
+
+        def download_song(i, s):
+            singers = "/".join(x["name"] for x in s.get("singer", []))
+            name = s.get("songname") or "?"
+            safe = "".join(c if c.isalnum() or c in " -_.()" else "_" for c in f"{name} - {singers}")
+            path = os.path.join(out_dir, f"{i:02d}. {safe}.m4a")
+            if fetch_to(urls[s["songmid"]], path) is None:
+                return "existing", f"{i}. {name} — {singers} (already downloaded)"
+            return "ok", f"{i}. {name} — {singers} ({os.path.getsize(path) / 1024 / 1024:.1f} MB)"
+
+        counts = {"ok": 0, "existing": 0, "failed": 0}
+        skipped = [(i, s) for i, s in enumerate(songs, 1) if s.get("songmid") not in urls]
+        start = time.monotonic()
+        with ThreadPoolExecutor(DOWNLOAD_WORKERS) as pool:
+            futures = {pool.submit(download_song, i, s): (i, s) for i, s in enumerate(songs, 1)
+                       if s.get("songmid") in urls}
+            for future in as_completed(futures):
+                i, s = futures[future]
+                try:
+                    outcome, line = future.result()
+                except Exception as e:
+                    outcome, line = "failed", f"{i}. FAILED: {s.get('songname', '?')} — {e}"
+                counts[outcome] += 1
+                print(line, flush=True)
+
+        print(f"\n{counts['ok']} downloaded, {counts['existing']} already present, "
+              f"{len(skipped)} skipped (no URL, usually VIP-only), {counts['failed']} failed "
+              f"in {time.monotonic() - start:.1f}s")
+        for i, s in skipped:
+            singers = "/".join(x["name"] for x in s.get("singer", []))
+            print(f"  skipped {i}. {s.get('songname', '?')} — {singers}")
+        print(f"Files in: {out_dir}")
 
     elif cmd == "url":
         if len(sys.argv) < 3:
@@ -228,23 +439,9 @@ if __name__ == "__main__":
         mid = sys.argv[2]
         cookie = load_cookie() or ""
         # Try to get play URL
-        data = api_call(
-            "vkey.GetVkeyServer",
-            "CgiGetVkey",
-            {
-                "guid": "1234567890",
-                "songmid": [mid],
-                "songtype": [0],
-                "uin": "0",
-                "loginflag": 1,
-                "platform": "20"
-            },
-            cookie
-        )
-        midurlinfo = data.get("midurlinfo", [])
-        if midurlinfo and midurlinfo[0].get("purl"):
-            sip = data.get("sip", ["https://ws.stream.qqmusic.qq.com/"])[0]
-            print(f"{sip}{midurlinfo[0]['purl']}")
+        audio_url = vkey_url(mid, cookie)
+        if audio_url:
+            print(audio_url)
         else:
             print("No URL available (may require VIP).")
             # Fallback: try lower quality
@@ -288,10 +485,23 @@ if __name__ == "__main__":
         out_dir = sys.argv[3] if len(sys.argv) > 3 and not sys.argv[3].startswith("-") else "."
 
         # Resolve to songmid
+        audio_url = None
         if len(arg) >= 10 and arg.isalnum():
             mid = arg
-            name = mid
-            artists = ""
+            # Song details and the stream URL are independent: one request for both
+            cached = url_cache_get("qq", [mid], 0).get(mid)
+            calls = [("music.pf_song_detail_svr", "get_song_detail_yqq", {"song_mid": mid, "song_type": 0})]
+            if not cached:
+                calls.append(vkey_request([mid]))
+            results = api_batch(calls, cookie)
+            info = results[0]["data"].get("track_info") or {}
+            name = info.get("name") or mid
+            artists = "/".join(x["name"] for x in info.get("singer", []))
+            if cached:
+                audio_url = cached["url"]
+            elif results[1]["code"] == 0:
+                audio_url = cache_vkey_urls(results[1]["data"]).get(mid)
+            print(f"Downloading: {name} — {artists}" if artists else f"Downloading: {name}")
         else:
             # Exclude output_dir from query
             query_parts = sys.argv[2:]
@@ -314,34 +524,20 @@ if __name__ == "__main__":
             artists = "/".join(x["name"] for x in s.get("singer", []))
             print(f"Downloading: {name} — {artists}")
 
-        # Get URL
-        data = api_call(
-            "vkey.GetVkeyServer",
-            "CgiGetVkey",
-            {
-                "guid": "1234567890",
-                "songmid": [mid],
-                "songtype": [0],
-                "uin": "0",
-                "loginflag": 1,
-                "platform": "20"
-            },
-            cookie
-        )
-        midurlinfo = data.get("midurlinfo", [])
-        if not midurlinfo or not midurlinfo[0].get("purl"):
+            audio_url = vkey_url(mid, cookie)
+
+        if not audio_url:
             print("No audio URL. Track may require VIP.")
             sys.exit(1)
 
-        sip = data.get("sip", ["https://ws.stream.qqmusic.qq.com/"])[0]
-        audio_url = f"{sip}{midurlinfo[0]['purl']}"
-
         os.makedirs(out_dir, exist_ok=True)
         safe = "".join(c if c.isalnum() or c in " -_.()" else "_" for c in f"{name} - {artists}")
         ext = "m4a"
         out_path = os.path.join(out_dir, f"{safe}.{ext}")
 
-        urllib.request.urlretrieve(audio_url, out_path)
+        if fetch_to(audio_url, out_path) is None:
+            print(f"Already downloaded: {out_path}")
+            sys.exit(0)
         size = os.path.getsize(out_path) / 1024 / 1024
         print(f"Saved: {out_path} ({size:.1f} MB)")
 
@@ -356,7 +552,7 @@ Auth:
   status                    Check login status
 
 Browse:
-  search <query>            Search songs
+  search <query> [--limit N]  Search songs (default 20; pages fetched in parallel)
   search-albums <query>     Search albums
   playlists                 Your playlists (needs login)
   playlist <id>             Tracks in a playlist
@@ -365,6 +561,7 @@ Audio:
   url <songmid>             Get audio URL
   play <mid|query>          Open in browser
   download <mid|query> [dir] Download audio
+  download-playlist <disstid> [dir] [--limit N]  Download a playlist
 
 Notes:
   - Search works without login
@@ -1,9 +1,53 @@
 #!/usr/bin/env python3
 """Spotify CLI for OpenClaw — OAuth PKCE auth + Web API client."""
-import http.server, json, sys, os, hashlib, base64, secrets, threading, subprocess
+import json, sys, os, socket
+
+CONFIG_DIR = os.path.expanduser("~/.config/openclaw-spotify")
+DAEMON_SOCKET = os.path.join(CONFIG_DIR, "daemon.sock")
+# Never forwarded to the daemon: they need this process's terminal, browser or stdin
+# (as do stdin/--file input and long-running --watch / --interval loops)
+IN_PROCESS_COMMANDS = {"auth", "config", "serve", "help", "resolve"}
+
+def forward_to_daemon(args):
+    """Run a command in the `serve` daemon; returns its exit code, or None if none is running."""
+    rest = list(args)
+    if "--account" in rest:
+        del rest[rest.index("--account"):rest.index("--account") + 2]
+    if not rest or rest[0] in IN_PROCESS_COMMANDS or {"-", "--file", "--watch", "--interval"} & set(rest):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(DAEMON_SOCKET)
+    except OSError:
+        sock.close()
+        return None
+    with sock:
+        request = {"argv": args, "account": os.environ.get("SPOTIFY_ACCOUNT")}
+        sock.sendall(json.dumps(request).encode() + b"\n")
+        for line in sock.makefile("rb"):
+            msg = json.loads(line)
+            if "exit" in msg:
+                return msg["exit"]
+            stream = sys.stdout if "out" in msg else sys.stderr
+            stream.write(msg.get("out", msg.get("err", "")))
+            stream.flush()
+    return 1  # daemon went away mid-command
+
+# Thin-client fast path: decided before the heavier imports below are paid for
+if __name__ == "__main__" and os.path.exists(DAEMON_SOCKET):
+    code = forward_to_daemon(sys.argv[1:])
+    if code is not None:
+        sys.exit(code)
+
+import http.server, http.client, hashlib, base64, secrets, threading, subprocess
+import gzip, time, collections, random, itertools, queue, sqlite3, re, contextlib, signal
+import datetime
+from concurrent.futures import ThreadPoolExecutor
 import urllib.parse
-import urllib.request
-import urllib.error
+try:
+    import fcntl
+except ImportError:  # no cross-process locking on Windows
+    fcntl = None
 
 DEFAULT_CLIENT_ID = ""
 PORT = 8989
@@ -14,76 +58,305 @@ SCOPES = (
     "user-follow-read user-follow-modify user-top-read user-read-recently-played "
     "user-library-read user-library-modify user-read-private user-read-email"
 )
-CONFIG_DIR = os.path.expanduser("~/.config/openclaw-spotify")
-TOKEN_FILE = os.path.join(CONFIG_DIR, "token.json")
+API_BASE = "https://api.spotify.com/v1"
+TOKEN_URL = "https://accounts.spotify.com/api/token"
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 30
+PAGE_CONCURRENCY = 4  # max in-flight page requests when paginating by offset
+TOKEN_REFRESH_MARGIN = 60  # refresh this many seconds before the token expires
+VAULT_STAGGER = 300   # scheduled refreshes start up to this much earlier, varying per account
+VAULT_POLL = 30       # how often `serve` checks every account for a due refresh
+RATE_BURST = 100      # shared token bucket: burst size...
+RATE_PER_SEC = 10     # ...and sustained requests/second per client ID, across processes
+MAX_RETRIES = 5       # for 429 / transient 5xx responses
+BACKOFF_CAP = 30      # seconds
+ADD_CHUNK = 100       # Spotify's max URIs per add-tracks request
+WATCH_MIN_INTERVAL = 1    # now --watch: polling around track ends and after changes
+WATCH_MAX_INTERVAL = 30   # ...and the longest sleep, so pauses/skips elsewhere are still seen
+WATCH_END_LEAD = 2        # wake this many seconds before the track should end
+WATCH_FAST_POLLS = 3      # quick polls after a change, when follow-ups are likely
+RESOLVE_BATCH = {"track": 50, "album": 20, "artist": 50}  # max IDs per batch endpoint
+METADATA_TTL = 7 * 86400  # resolve: how long cached metadata is reused
+HISTORY_COMPACT_LINES = 500   # history log entries before they're folded into library.db
+HISTORY_INTERVAL = 1200       # history ingest --interval default (50 plays take ~3h)
 CONFIG_FILE = os.path.join(CONFIG_DIR, "config.json")
+ACCOUNTS_DIR = os.path.join(CONFIG_DIR, "accounts")
+CACHE_MAX_BYTES = 50 * 1024 * 1024
+# GET response cache: (path regex, seconds served without revalidating); first match wins.
+# None = never cached; 0 = always revalidated with If-None-Match. Unlisted paths bypass it.
+CACHE_RULES = [
+    (r"/me/player", None),
+    (r"/me$", 3600),
+    (r"/me/top/", 3600),
+    (r"/me/following", 300),
+    (r"/me/(playlists|tracks)", 60),
+    (r"/playlists/", 0),
+    (r"/(tracks|albums|artists)", 86400),
+    (r"/search", 600),
+]
 
 os.makedirs(CONFIG_DIR, exist_ok=True)
 
-def get_client_id():
-    if os.path.exists(CONFIG_FILE):
-        with open(CONFIG_FILE) as f:
-            cfg = json.load(f)
-            if cfg.get("client_id"):
-                return cfg["client_id"]
+# --- Accounts: the default one lives directly in CONFIG_DIR, others in accounts/<name>/ ---
+
+def account_dir(name):
+    return os.path.join(ACCOUNTS_DIR, name) if name else CONFIG_DIR
+
+def select_account(name):
+    """Point the per-account files (token, library mirror, cache, history) at `name`."""
+    global ACCOUNT, ACCOUNT_DIR, TOKEN_FILE, LIBRARY_DB, CACHE_DIR, HISTORY_LOG, _client_id
+    if name and not re.fullmatch(r"[\w.-]+", name):
+        print(f"Invalid account name: {name}")
+        sys.exit(1)
+    ACCOUNT = name or None
+    ACCOUNT_DIR = account_dir(ACCOUNT)
+    os.makedirs(ACCOUNT_DIR, exist_ok=True)
+    TOKEN_FILE = os.path.join(ACCOUNT_DIR, "token.json")
+    LIBRARY_DB = os.path.join(ACCOUNT_DIR, "library.db")
+    CACHE_DIR = os.path.join(ACCOUNT_DIR, "cache")
+    HISTORY_LOG = os.path.join(ACCOUNT_DIR, "history.ndjson")
+    _client_id = None
+
+select_account(os.environ.get("SPOTIFY_ACCOUNT"))
+
+# --- HTTP: pooled keep-alive connections to api/accounts.spotify.com ---
+
+_pool = {}
+_pool_lock = threading.Lock()
+# Errors that mean a reused keep-alive socket was closed by the server
+_STALE_ERRORS = (http.client.RemoteDisconnected, http.client.CannotSendRequest,
+                 http.client.BadStatusLine, ConnectionResetError, BrokenPipeError)
+_IDEMPOTENT = {"GET", "HEAD", "PUT", "DELETE"}
+
+def _checkout(host):
+    with _pool_lock:
+        idle = _pool.get(host)
+        if idle:
+            return idle.pop(), True
+    conn = http.client.HTTPSConnection(host, timeout=CONNECT_TIMEOUT)
+    conn.connect()
+    conn.sock.settimeout(READ_TIMEOUT)
+    return conn, False
+
+def _checkin(host, conn):
+    with _pool_lock:
+        _pool.setdefault(host, []).append(conn)
+
+def http_request(method, url, body=None, headers=None):
+    """HTTP/1.1 request over a pooled keep-alive connection. Returns (status, headers, body)."""
+    parts = urllib.parse.urlsplit(url)
+    path = parts.path + (f"?{parts.query}" if parts.query else "")
+    hdrs = {"Accept-Encoding": "gzip", "Connection": "keep-alive", **(headers or {})}
+    while True:
+        start = time.monotonic()
+        conn, reused = _checkout(parts.netloc)
+        sent = False
+        try:
+            conn.request(method, path, body=body, headers=hdrs)
+            sent = True
+            resp = conn.getresponse()
+            payload = resp.read()
+        except _STALE_ERRORS:
+            conn.close()
+            # Server dropped an idle connection: retry on a fresh one, unless the
+            # request may already have been applied and resending could repeat it
+            if reused and (not sent or method in _IDEMPOTENT):
+                continue
+            raise
+        except Exception:
+            conn.close()
+            raise
+        if resp.will_close:
+            conn.close()
+        else:
+            _checkin(parts.netloc, conn)
+        if resp.getheader("Content-Encoding") == "gzip":
+            payload = gzip.decompress(payload)
+        if os.environ.get("SPOTIFY_TRACE"):
+            ms = (time.monotonic() - start) * 1000
+            print(f"[http] {method} {parts.netloc}{parts.path} {resp.status} {ms:.0f}ms"
+                  f"{' (reused)' if reused else ''}", file=sys.stderr)
+        return resp.status, resp.headers, payload
+
+def send(method, url, body=None, headers=None):
+    """http_request() that exits with a readable message on network failure."""
+    try:
+        return http_request(method, url, body, headers)
+    except (OSError, http.client.HTTPException) as e:
+        print(f"Network error: {e}")
+        sys.exit(1)
+
+def get_client_id(directory=None):
+    """Client ID from the account's config.json, else the shared one."""
+    for path in dict.fromkeys([os.path.join(directory or ACCOUNT_DIR, "config.json"), CONFIG_FILE]):
+        if os.path.exists(path):
+            with open(path) as f:
+                cfg = json.load(f)
+                if cfg.get("client_id"):
+                    return cfg["client_id"]
     if DEFAULT_CLIENT_ID:
         return DEFAULT_CLIENT_ID
     print("ERROR: No client_id configured. Run: spotify.py config --client-id YOUR_CLIENT_ID")
     sys.exit(1)
 
 def save_config(client_id):
+    path = os.path.join(ACCOUNT_DIR, "config.json")
     cfg = {}
-    if os.path.exists(CONFIG_FILE):
-        with open(CONFIG_FILE) as f:
+    if os.path.exists(path):
+        with open(path) as f:
             cfg = json.load(f)
     cfg["client_id"] = client_id
-    with open(CONFIG_FILE, "w") as f:
+    with open(path, "w") as f:
         json.dump(cfg, f, indent=2)
-    os.chmod(CONFIG_FILE, 0o600)
-    print(f"Client ID saved to {CONFIG_FILE}")
+    os.chmod(path, 0o600)
+    print(f"Client ID saved to {path}")
 
-def get_token():
-    if os.path.exists(TOKEN_FILE):
-        with open(TOKEN_FILE) as f:
-            data = json.load(f)
-            if "access_token" in data:
-                return data["access_token"]
-    return None
+# --- Token lifecycle: cached in-process, refreshed shortly before expiry ---
 
-def get_refresh_token():
-    if os.path.exists(TOKEN_FILE):
-        with open(TOKEN_FILE) as f:
-            data = json.load(f)
-            return data.get("refresh_token")
-    return None
+_tokens = {}   # token file -> (mtime, contents)
+_token_locks = collections.defaultdict(threading.Lock)
 
-def refresh_access_token():
-    rt = get_refresh_token()
-    if not rt:
-        return None
-    client_id = get_client_id()
-    data = urllib.parse.urlencode({
-        "grant_type": "refresh_token",
-        "refresh_token": rt,
-        "client_id": client_id,
-    }).encode()
-    req = urllib.request.Request(
-        "https://accounts.spotify.com/api/token",
-        data=data,
-        headers={"Content-Type": "application/x-www-form-urlencoded"},
-    )
+def write_json_atomic(path, data):
+    """Write JSON via a temp file + rename so readers never see a partial file."""
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        json.dump(data, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+@contextlib.contextmanager
+def file_lock(path):
+    """Exclusive advisory lock on `path` (created if missing), shared across processes."""
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        if fcntl:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+def load_token(path=None):
+    """token.json contents (the selected account's by default), read once per process.
+
+    The file is re-read only if another process has replaced it since (a
+    long-lived `serve` daemon must not hold on to a rotated refresh token).
+    """
+    path = path or TOKEN_FILE
     try:
-        resp = urllib.request.urlopen(req)
-        token_data = json.loads(resp.read())
+        mtime = os.stat(path).st_mtime
+    except FileNotFoundError:
+        mtime = None
+    cached = _tokens.get(path)
+    if cached is None or cached[0] != mtime:
+        data = {}
+        if mtime is not None:
+            with open(path) as f:
+                data = json.load(f)
+        cached = _tokens[path] = (mtime, data)
+    return cached[1]
+
+def save_token(token_data, path=None):
+    """Persist a token response, recording expires_in as an absolute expires_at."""
+    path = path or TOKEN_FILE
+    if "expires_in" in token_data:
+        token_data["expires_at"] = int(time.time()) + int(token_data["expires_in"])
+    write_json_atomic(path, token_data)
+    _tokens[path] = (os.stat(path).st_mtime, token_data)
+
+def token_expiring(data):
+    expires_at = data.get("expires_at")
+    return bool(expires_at) and time.time() >= expires_at - TOKEN_REFRESH_MARGIN
+
+def get_token():
+    data = load_token()
+    if "access_token" not in data:
+        return None
+    if token_expiring(data):
+        # Falls back to the current token if refresh fails; a 401 retries it
+        return refresh_access_token(stale=data["access_token"]) or data["access_token"]
+    return data["access_token"]
+
+def get_refresh_token(path=None):
+    return load_token(path).get("refresh_token")
+
+def refresh_access_token(stale=None, path=None, quiet=False):
+    """Exchange an account's refresh token for a new access token.
+
+    At most one refresh per account runs at a time, across threads and
+    processes (token.json.lock). Whoever waited for it re-reads token.json:
+    if the `stale` token was already replaced by a fresh one, that is
+    returned without hitting accounts.spotify.com again. With `quiet`,
+    network errors return None instead of exiting.
+    """
+    path = path or TOKEN_FILE
+    with _token_locks[path], file_lock(path + ".lock"):
+        current = load_token(path)
+        if (current.get("access_token") and current["access_token"] != stale
+                and not token_expiring(current)):
+            return current["access_token"]
+        rt = get_refresh_token(path)
+        if not rt:
+            return None
+        client_id = get_client_id(os.path.dirname(path))
+        data = urllib.parse.urlencode({
+            "grant_type": "refresh_token",
+            "refresh_token": rt,
+            "client_id": client_id,
+        }).encode()
+        headers = {"Content-Type": "application/x-www-form-urlencoded"}
+        if quiet:
+            try:
+                status, _, payload = http_request("POST", TOKEN_URL, data, headers)
+            except (OSError, http.client.HTTPException):
+                return None
+        else:
+            status, _, payload = send("POST", TOKEN_URL, data, headers)
+        if status != 200:
+            return None
+        token_data = json.loads(payload)
         # Preserve refresh_token if not returned
         if "refresh_token" not in token_data:
             token_data["refresh_token"] = rt
-        with open(TOKEN_FILE, "w") as f:
-            json.dump(token_data, f, indent=2)
-        os.chmod(TOKEN_FILE, 0o600)
+        save_token(token_data, path)
         return token_data.get("access_token")
-    except urllib.error.HTTPError:
-        return None
+
+def list_accounts():
+    """Names of accounts that have a token; None is the default account."""
+    names = [None] if os.path.exists(os.path.join(CONFIG_DIR, "token.json")) else []
+    if os.path.isdir(ACCOUNTS_DIR):
+        names += sorted(n for n in os.listdir(ACCOUNTS_DIR)
+                        if os.path.exists(os.path.join(ACCOUNTS_DIR, n, "token.json")))
+    return names
+
+def refresh_due(name, data):
+    """Whether an account is inside its refresh window, which opens up to
+    VAULT_STAGGER seconds early at a per-account offset so accounts don't
+    all refresh at once."""
+    stagger = int(hashlib.sha1((name or "").encode()).hexdigest(), 16) % VAULT_STAGGER
+    expires_at = data.get("expires_at")
+    return bool(expires_at) and time.time() >= expires_at - TOKEN_REFRESH_MARGIN - stagger
+
+def refresh_vault(quiet=False):
+    """Refresh every account whose window is open; returns the names refreshed."""
+    refreshed = []
+    for name in list_accounts():
+        path = os.path.join(account_dir(name), "token.json")
+        data = load_token(path)
+        if data.get("refresh_token") and refresh_due(name, data):
+            if refresh_access_token(stale=data.get("access_token"), path=path, quiet=quiet):
+                refreshed.append(name or "default")
+    return refreshed
+
+def _vault_refresher():
+    # Runs inside `serve`; must never print, since stdout may be a client's stream
+    while True:
+        try:
+            refresh_vault(quiet=True)
+        except (Exception, SystemExit):
+            pass
+        time.sleep(VAULT_POLL)
 
 def auth():
     client_id = get_client_id()
@@ -144,58 +417,733 @@ def auth():
         "client_id": client_id,
         "code_verifier": verifier,
     }).encode()
-    req = urllib.request.Request(
-        "https://accounts.spotify.com/api/token",
-        data=data,
-        headers={"Content-Type": "application/x-www-form-urlencoded"},
-    )
-    resp = urllib.request.urlopen(req)
-    token_data = json.loads(resp.read())
-
-    with open(TOKEN_FILE, "w") as f:
-        json.dump(token_data, f, indent=2)
-    os.chmod(TOKEN_FILE, 0o600)
+    status, _, payload = send("POST", TOKEN_URL, data,
+                              {"Content-Type": "application/x-www-form-urlencoded"})
+    if status != 200:
+        print(f"ERROR: Token exchange failed ({status}): {payload.decode(errors='replace')}")
+        sys.exit(1)
+    token_data = json.loads(payload)
+
+    save_token(token_data)
     print(f"TOKEN_SAVED:{TOKEN_FILE}")
     return token_data["access_token"]
 
-def api(endpoint, method="GET", body=None):
+# --- Scheduling: shared rate budget + 429/5xx retries ---
+
+_client_id = None
+
+def _bucket_file():
+    global _client_id
+    if _client_id is None:
+        _client_id = get_client_id()
+    return os.path.join(CONFIG_DIR, f"ratelimit-{_client_id}.json")
+
+def _with_bucket(update):
+    """Apply update(state, now) to the rate bucket shared by all processes for this client ID.
+
+    The state file is held under an exclusive flock while it is read and rewritten.
+    """
+    fd = os.open(_bucket_file(), os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        if fcntl:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            state = json.loads(os.read(fd, 4096) or b"{}")
+        except ValueError:
+            state = {}
+        now = time.time()
+        tokens = state.get("tokens", RATE_BURST) + (now - state.get("updated", now)) * RATE_PER_SEC
+        state["tokens"] = min(RATE_BURST, tokens)
+        state["updated"] = now
+        result = update(state, now)
+        os.lseek(fd, 0, os.SEEK_SET)
+        os.ftruncate(fd, 0)
+        os.write(fd, json.dumps(state).encode())
+        return result
+    finally:
+        os.close(fd)  # also releases the lock
+
+def _take(state, now):
+    blocked = state.get("blocked_until", 0) - now
+    if blocked > 0:
+        return blocked
+    if state["tokens"] >= 1:
+        state["tokens"] -= 1
+        return 0
+    return (1 - state["tokens"]) / RATE_PER_SEC
+
+def acquire_budget():
+    """Block until the shared bucket grants one request."""
+    while True:
+        wait = _with_bucket(_take)
+        if wait <= 0:
+            return
+        time.sleep(wait + random.uniform(0, 0.1))
+
+def block_budget(seconds):
+    """Pause every process sharing this client ID, e.g. after a 429."""
+    def update(state, now):
+        state["blocked_until"] = max(state.get("blocked_until", 0), now + seconds)
+        state["tokens"] = 0
+    _with_bucket(update)
+
+def retry_delay(headers, attempt):
+    """Retry-After if the server sent one, else capped exponential backoff; both jittered."""
+    try:
+        delay = float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        delay = min(BACKOFF_CAP, 2 ** attempt)
+    return delay * random.uniform(1.0, 1.25)
+
+def scheduled_send(method, url, data, headers):
+    """send() under the shared budget, retrying 429s and (for non-POST) transient 5xx."""
+    for attempt in range(MAX_RETRIES + 1):
+        acquire_budget()
+        status, resp_headers, payload = send(method, url, data, headers)
+        retryable = status == 429 or (status in (500, 502, 503, 504) and method != "POST")
+        if not retryable or attempt == MAX_RETRIES:
+            break
+        delay = retry_delay(resp_headers, attempt)
+        if status == 429:
+            block_budget(delay)
+        print(f"[spotify] {status} on {method} {urllib.parse.urlsplit(url).path}, "
+              f"retrying in {delay:.1f}s", file=sys.stderr)
+        time.sleep(delay)
+    return status, resp_headers, payload
+
+# --- Conditional-request cache for GETs (ETag / If-None-Match) ---
+
+def cache_ttl(url):
+    path = urllib.parse.urlsplit(url).path[len("/v1"):]
+    for pattern, ttl in CACHE_RULES:
+        if re.match(pattern, path):
+            return ttl
+    return None
+
+def _resource_key(url):
+    # Entries are grouped by resource (e.g. /playlists/<id>) so writes can drop them
+    resource = "/".join(urllib.parse.urlsplit(url).path.split("/")[:4])
+    return hashlib.sha1(resource.encode()).hexdigest()[:10]
+
+def _cache_path(url):
+    return os.path.join(CACHE_DIR, f"{_resource_key(url)}-{hashlib.sha1(url.encode()).hexdigest()}.json")
+
+def cache_get(url):
+    path = _cache_path(url)
+    try:
+        with open(path) as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    try:
+        os.utime(path)  # mtime doubles as the LRU clock
+    except OSError:
+        pass  # evicted or invalidated since the read; the entry is still good to return
+    return entry
+
+_cache_sizes = {}   # cache dir -> running byte total (an upper bound between scans)
+_cache_size_lock = threading.Lock()
+
+def _cache_entries():
+    """(mtime, size, path) of finished cache files; files renamed or removed
+    by another thread mid-scan, and in-flight *.tmp writes, are skipped."""
+    entries = []
+    for e in os.scandir(CACHE_DIR):
+        if e.name.endswith(".tmp"):
+            continue
+        try:
+            st = e.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((st.st_mtime, st.st_size, e.path))
+    return entries
+
+def cache_put(url, etag, payload):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = _cache_path(url)
+    write_json_atomic(path, {"url": url, "etag": etag, "stored": time.time(),
+                             "body": payload.decode()})
+    try:
+        size = os.path.getsize(path)
+    except FileNotFoundError:
+        size = 0
+    with _cache_size_lock:
+        total = _cache_sizes.get(CACHE_DIR)
+        if total is None:
+            total = sum(size for _, size, _ in _cache_entries())
+        else:
+            total += size
+        _cache_sizes[CACHE_DIR] = total
+        if total > CACHE_MAX_BYTES:
+            _cache_sizes[CACHE_DIR] = _cache_evict()
+
+def cache_invalidate(url):
+    prefix = _resource_key(url) + "-"
+    if os.path.isdir(CACHE_DIR):
+        for e in os.scandir(CACHE_DIR):
+            if e.name.startswith(prefix) and not e.name.endswith(".tmp"):
+                try:
+                    os.remove(e.path)
+                except FileNotFoundError:
+                    pass
+
+def _cache_evict():
+    """Remove least recently used entries until under CACHE_MAX_BYTES; returns the new total."""
+    entries = sorted(_cache_entries())
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in entries:
+        if total <= CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+    return total
+
+def _trace(msg):
+    if os.environ.get("SPOTIFY_TRACE"):
+        print(f"[cache] {msg}", file=sys.stderr)
+
+class APIError(Exception):
+    """An HTTP error status from the Web API, raised by api(..., raise_errors=True)."""
+    def __init__(self, status, payload):
+        super().__init__(f"API Error {status}: {payload.decode(errors='replace')}")
+        self.status = status
+
+def api(endpoint, method="GET", body=None, max_age=None, raise_errors=False):
+    """Call the Web API and return parsed JSON (exits on errors).
+
+    GETs on paths in CACHE_RULES are served from the local cache while
+    younger than the rule's TTL (or `max_age`, if given), and otherwise
+    revalidated with If-None-Match; a 304 counts as a hit. With
+    `raise_errors`, an HTTP error status raises APIError instead of exiting.
+    """
+    # Accept absolute URLs too, e.g. `next` links from paged responses
+    url = endpoint if endpoint.startswith("https://") else f"{API_BASE}{endpoint}"
+    ttl = cache_ttl(url) if method == "GET" else None
+    entry = cache_get(url) if ttl is not None else None
+    if entry:
+        age = time.time() - entry["stored"]
+        if age < (ttl if max_age is None else max_age):
+            _trace(f"hit {url} (age {age:.0f}s)")
+            return json.loads(entry["body"]) if entry["body"] else {}
+
     token = get_token()
     if not token:
         print("No token. Run: spotify.py auth")
         sys.exit(1)
 
-    url = f"https://api.spotify.com/v1{endpoint}"
     data = json.dumps(body).encode() if body else None
     headers = {"Authorization": f"Bearer {token}"}
     if body:
         headers["Content-Type"] = "application/json"
+    if entry and entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
 
-    req = urllib.request.Request(url, data=data, headers=headers, method=method)
-    try:
-        resp = urllib.request.urlopen(req)
-        if resp.status == 204:
-            return {}
-        return json.loads(resp.read())
-    except urllib.error.HTTPError as e:
-        if e.code == 401:
-            # Try refresh
-            new_token = refresh_access_token()
-            if new_token:
-                headers["Authorization"] = f"Bearer {new_token}"
-                req = urllib.request.Request(url, data=data, headers=headers, method=method)
-                try:
-                    resp = urllib.request.urlopen(req)
-                    if resp.status == 204:
-                        return {}
-                    return json.loads(resp.read())
-                except urllib.error.HTTPError as e2:
-                    print(f"API Error {e2.code}: {e2.read().decode()}")
-                    sys.exit(1)
+    status, resp_headers, payload = scheduled_send(method, url, data, headers)
+    if status == 401:
+        # Try refresh
+        new_token = refresh_access_token(stale=token)
+        if not new_token:
+            print("Token expired. Run: spotify.py auth")
+            sys.exit(1)
+        headers["Authorization"] = f"Bearer {new_token}"
+        status, resp_headers, payload = scheduled_send(method, url, data, headers)
+    if status == 304 and entry:
+        _trace(f"revalidated {url}")
+        cache_put(url, entry["etag"], entry["body"].encode())
+        payload = entry["body"].encode()
+    elif status >= 400:
+        if raise_errors:
+            raise APIError(status, payload)
+        print(f"API Error {status}: {payload.decode(errors='replace')}")
+        sys.exit(1)
+    elif ttl is not None and (ttl or resp_headers.get("ETag")):
+        cache_put(url, resp_headers.get("ETag"), payload)
+    elif method != "GET":
+        cache_invalidate(url)
+    if status == 204 or not payload:
+        return {}
+    return json.loads(payload)
+
+def page_size(limit, cap):
+    """Per-request page size: the endpoint's maximum unless fewer items are wanted."""
+    return min(limit, cap) if limit else cap
+
+def _with_offset(url, offset):
+    parts = urllib.parse.urlsplit(url)
+    query = dict(urllib.parse.parse_qsl(parts.query))
+    query["offset"] = str(offset)
+    return urllib.parse.urlunsplit(parts._replace(query=urllib.parse.urlencode(query)))
+
+def paginate(endpoint, key=None, limit=None, concurrent=True, max_age=None):
+    """Yield items from a paged endpoint until `limit` items or the last page.
+
+    `key` names the paging object inside the response (e.g. "artists" for
+    /me/following); `max_age` is passed to api(). Cursor-paged endpoints follow
+    `next` one page at a time.
+    Offset-paged endpoints that report `total` fetch the remaining pages
+    concurrently, at most PAGE_CONCURRENCY in flight, still yielding in order.
+    """
+    page = api(endpoint, max_age=max_age)
+    page = page.get(key, {}) if key else page
+    remaining = limit if limit is not None else float("inf")
+
+    def emit(items):
+        nonlocal remaining
+        for item in items:
+            if remaining <= 0:
+                return
+            remaining -= 1
+            yield item
+
+    yield from emit(page.get("items", []))
+    offset_paged = "total" in page and "offset" in page and "cursors" not in page
+    if not (concurrent and offset_paged):
+        while page.get("next") and remaining > 0:
+            sys.stdout.flush()  # rows printed so far reach the reader before we block
+            page = api(page["next"], max_age=max_age)
+            page = page.get(key, page) if key else page
+            yield from emit(page.get("items", []))
+        return
+
+    step = page.get("limit") or len(page.get("items", [])) or 1
+    end = min(page["total"], page["offset"] + len(page.get("items", [])) + remaining)
+    offsets = iter(range(page["offset"] + step, end, step))
+    base = page.get("next") or ""
+    if not base:
+        return
+    inflight = collections.deque()
+    with ThreadPoolExecutor(max_workers=PAGE_CONCURRENCY) as pool:
+        try:
+            for off in offsets:
+                inflight.append(pool.submit(api, _with_offset(base, off), max_age=max_age))
+                if len(inflight) >= PAGE_CONCURRENCY:
+                    break
+            while inflight and remaining > 0:
+                sys.stdout.flush()
+                result = inflight.popleft().result()
+                result = result.get(key, result) if key else result
+                yield from emit(result.get("items", []))
+                off = next(offsets, None)
+                if off is not None:
+                    inflight.append(pool.submit(api, _with_offset(base, off), max_age=max_age))
+        finally:
+            for f in inflight:
+                f.cancel()
+
+def to_uri(ref, default_type="track"):
+    """Normalize a Spotify URI, open.spotify.com URL or bare ID to a spotify: URI."""
+    if ref.startswith("spotify:"):
+        return ref
+    if "open.spotify.com/" in ref:
+        path = urllib.parse.urlsplit(ref).path.strip("/").split("/")
+        if len(path) >= 2:
+            return f"spotify:{path[-2]}:{path[-1]}"
+    return f"spotify:{default_type}:{ref}"
+
+def read_uris(lines):
+    """Yield track URIs from plain lines (URI/URL/ID) or NDJSON objects with `uri` or `id`."""
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if line.startswith("{"):
+            obj = json.loads(line)
+            line = obj.get("uri") or obj.get("id") or ""
+            if not line:
+                continue
+        yield to_uri(line)
+
+def chunked(iterable, size):
+    it = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+def prefetch(iterable, depth):
+    """Consume `iterable` on a background thread, staying up to `depth` items ahead."""
+    q = queue.Queue(depth)
+
+    def run():
+        try:
+            for item in iterable:
+                q.put((True, item))
+            q.put((False, None))
+        except Exception as e:
+            q.put((False, e))
+
+    threading.Thread(target=run, daemon=True).start()
+    while True:
+        ok, item = q.get()
+        if ok:
+            yield item
+        elif item is not None:
+            raise item
+        else:
+            return
+
+def bulk_add(pid, uris, resume=False):
+    """Add any number of URIs to a playlist in ADD_CHUNK-sized requests, in order.
+
+    Each chunk is inserted at an explicit `position`, and progress is saved to
+    bulk-add-<pid>.json after every confirmed chunk. With `resume`, a failed run
+    picks up after the last confirmed chunk: if the playlist's snapshot_id has
+    moved on by exactly the unconfirmed chunk, that chunk is treated as landed.
+    Returns the number of tracks added by this run.
+    """
+    state_file = os.path.join(ACCOUNT_DIR, f"bulk-add-{pid}.json")
+    state = None
+    if os.path.exists(state_file):
+        with open(state_file) as f:
+            state = json.load(f)
+        if not resume:
+            print(f"An unfinished bulk add to {pid} exists ({state['added']} added). "
+                  f"Re-run with --resume, or delete {state_file} to start over.")
+            sys.exit(1)
+    info = api(f"/playlists/{pid}?fields=snapshot_id,tracks.total")
+    total = info["tracks"]["total"]
+    if state:
+        if info["snapshot_id"] != state["snapshot_id"]:
+            if state["pending"] and total == state["base"] + state["added"] + state["pending"]:
+                state["added"] += state["pending"]
             else:
-                print("Token expired. Run: spotify.py auth")
-                sys.exit(1)
-        print(f"API Error {e.code}: {e.read().decode()}")
+                print("Playlist changed since the last confirmed chunk; "
+                      "appending the remaining tracks at the end.", file=sys.stderr)
+                state["base"] = total - state["added"]
+            state["snapshot_id"] = info["snapshot_id"]
+        state["pending"] = 0
+        print(f"Resuming after {state['added']} track(s).", file=sys.stderr)
+    else:
+        state = {"base": total, "added": 0, "pending": 0, "snapshot_id": info["snapshot_id"]}
+    skipped = state["added"]
+
+    # Input is read and parsed ahead on a thread while chunks are being posted
+    for chunk in prefetch(chunked(itertools.islice(uris, skipped, None), ADD_CHUNK), 4):
+        state["pending"] = len(chunk)
+        write_json_atomic(state_file, state)
+        result = api(f"/playlists/{pid}/tracks", "POST",
+                     {"uris": chunk, "position": state["base"] + state["added"]})
+        state["added"] += len(chunk)
+        state["pending"] = 0
+        state["snapshot_id"] = result.get("snapshot_id", state["snapshot_id"])
+        write_json_atomic(state_file, state)
+        print(f"  {state['added']} track(s) added", file=sys.stderr)
+    if os.path.exists(state_file):
+        os.remove(state_file)
+    return state["added"] - skipped
+
+# --- Local library mirror (spotify.py sync / --local) ---
+
+LIBRARY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS playlists (
+    id TEXT PRIMARY KEY, name TEXT, owner TEXT, snapshot_id TEXT, total INTEGER, position INTEGER);
+CREATE TABLE IF NOT EXISTS playlist_tracks (
+    playlist_id TEXT, position INTEGER, uri TEXT, name TEXT, artists TEXT, added_at TEXT,
+    PRIMARY KEY (playlist_id, position));
+CREATE TABLE IF NOT EXISTS saved_tracks (
+    uri TEXT PRIMARY KEY, name TEXT, artists TEXT, added_at TEXT);
+CREATE INDEX IF NOT EXISTS saved_tracks_added ON saved_tracks (added_at);
+CREATE TABLE IF NOT EXISTS followed_artists (
+    id TEXT PRIMARY KEY, name TEXT, genres TEXT, position INTEGER);
+CREATE TABLE IF NOT EXISTS metadata (
+    uri TEXT PRIMARY KEY, json TEXT, fetched_at REAL);
+CREATE TABLE IF NOT EXISTS plays (
+    played_at TEXT PRIMARY KEY, ts INTEGER, track_uri TEXT, track_name TEXT, artists TEXT,
+    duration_ms INTEGER, context_uri TEXT);
+CREATE INDEX IF NOT EXISTS plays_ts ON plays (ts, track_uri);
+CREATE TABLE IF NOT EXISTS play_artists (
+    played_at TEXT, ts INTEGER, artist_id TEXT, artist_name TEXT, PRIMARY KEY (played_at, artist_id));
+CREATE INDEX IF NOT EXISTS play_artists_ts ON play_artists (ts, artist_id);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY, value TEXT);
+"""
+PLAYLIST_TRACK_FIELDS = "items(added_at,track(uri,name,artists(name))),total,offset,limit,next"
+
+def open_library():
+    db = sqlite3.connect(LIBRARY_DB)
+    db.executescript(LIBRARY_SCHEMA)
+    return db
+
+def _track_row(t):
+    return t["uri"], t["name"], json.dumps([a["name"] for a in t["artists"]], ensure_ascii=False)
+
+def sync_library(db):
+    """Bring the mirror up to date, fetching only what changed.
+
+    Playlists whose snapshot_id matches the mirror are not re-read. Saved
+    tracks are read newest-first until one older than the newest mirrored
+    added_at; if the counts then disagree (tracks were removed), they are
+    re-read in full. Followed artists are always refreshed (a few pages).
+    Every read is revalidated against the API rather than served by TTL.
+    """
+    stats = collections.Counter()
+    seen = []
+    for pos, p in enumerate(paginate("/me/playlists?limit=50", max_age=0)):
+        seen.append(p["id"])
+        row = db.execute("SELECT snapshot_id FROM playlists WHERE id = ?", (p["id"],)).fetchone()
+        if not row or row[0] != p["snapshot_id"]:
+            db.execute("DELETE FROM playlist_tracks WHERE playlist_id = ?", (p["id"],))
+            items = paginate(f"/playlists/{p['id']}/tracks?limit=100&fields={PLAYLIST_TRACK_FIELDS}",
+                             max_age=0)
+            for i, item in enumerate(items):
+                t = item.get("track")
+                uri, name, artists = _track_row(t) if t else (None, None, None)
+                db.execute("INSERT INTO playlist_tracks VALUES (?, ?, ?, ?, ?, ?)",
+                           (p["id"], i, uri, name, artists, item.get("added_at")))
+            stats["playlists_changed"] += 1
+        db.execute("INSERT OR REPLACE INTO playlists VALUES (?, ?, ?, ?, ?, ?)",
+                   (p["id"], p["name"], (p.get("owner") or {}).get("id"), p["snapshot_id"],
+                    p.get("tracks", {}).get("total"), pos))
+        db.commit()
+    stats["playlists"] = len(seen)
+    marks = ",".join("?" * len(seen))
+    db.execute(f"DELETE FROM playlist_tracks WHERE playlist_id NOT IN ({marks})", seen)
+    db.execute(f"DELETE FROM playlists WHERE id NOT IN ({marks})", seen)
+    db.commit()
+
+    before = db.execute("SELECT COUNT(*) FROM saved_tracks").fetchone()[0]
+    newest = db.execute("SELECT MAX(added_at) FROM saved_tracks").fetchone()[0]
+    first = api("/me/tracks?limit=50", max_age=0)
+    rest = paginate(first["next"], concurrent=False, max_age=0) if first.get("next") else ()
+    for item in itertools.chain(first["items"], rest):
+        # Same-second additions are re-read rather than missed
+        if newest and item["added_at"] < newest:
+            break
+        db.execute("INSERT OR IGNORE INTO saved_tracks VALUES (?, ?, ?, ?)",
+                   (*_track_row(item["track"]), item["added_at"]))
+    if db.execute("SELECT COUNT(*) FROM saved_tracks").fetchone()[0] != first["total"]:
+        db.execute("DELETE FROM saved_tracks")
+        for item in paginate("/me/tracks?limit=50", max_age=0):
+            db.execute("INSERT OR REPLACE INTO saved_tracks VALUES (?, ?, ?, ?)",
+                       (*_track_row(item["track"]), item["added_at"]))
+    stats["saved_new"] = max(0, db.execute("SELECT COUNT(*) FROM saved_tracks").fetchone()[0] - before)
+    db.commit()
+
+    db.execute("DELETE FROM followed_artists")
+    for pos, a in enumerate(paginate("/me/following?type=artist&limit=50", key="artists", max_age=0)):
+        db.execute("INSERT OR REPLACE INTO followed_artists VALUES (?, ?, ?, ?)",
+                   (a["id"], a["name"], json.dumps(a.get("genres", []), ensure_ascii=False), pos))
+        stats["following"] += 1
+    # history/resolve also create library.db; this marks the mirror as synced
+    db.execute("INSERT OR REPLACE INTO meta VALUES ('last_sync', ?)", (str(time.time()),))
+    db.commit()
+    return stats
+
+def _require_mirror():
+    db = open_library() if os.path.exists(LIBRARY_DB) else None
+    if not db or not db.execute("SELECT 1 FROM meta WHERE key = 'last_sync'").fetchone():
+        print("No local library. Run: spotify.py sync")
         sys.exit(1)
+    return db
+
+def _local_track(name, artists):
+    return {"name": name, "artists": [{"name": a} for a in json.loads(artists)]}
+
+def local_playlists():
+    """Mirror rows shaped like /me/playlists items."""
+    db = _require_mirror()
+    for pid, name, total in db.execute("SELECT id, name, total FROM playlists ORDER BY position"):
+        yield {"id": pid, "name": name, "tracks": {"total": total}}
+
+def local_playlist_tracks(pid, limit=None):
+    """Mirror rows shaped like /playlists/{id}/tracks items."""
+    db = _require_mirror()
+    rows = db.execute("SELECT name, artists, added_at FROM playlist_tracks WHERE playlist_id = ? "
+                      "ORDER BY position LIMIT ?", (pid, limit or -1))
+    for name, artists, added_at in rows:
+        yield {"added_at": added_at, "track": _local_track(name, artists) if name else None}
+
+def local_saved(limit=None):
+    """Mirror rows shaped like /me/tracks items, newest first."""
+    db = _require_mirror()
+    rows = db.execute("SELECT name, artists, added_at FROM saved_tracks "
+                      "ORDER BY added_at DESC LIMIT ?", (limit or -1,))
+    for name, artists, added_at in rows:
+        yield {"added_at": added_at, "track": _local_track(name, artists)}
+
+def local_following():
+    db = _require_mirror()
+    for name, genres in db.execute("SELECT name, genres FROM followed_artists ORDER BY position"):
+        yield {"name": name, "genres": json.loads(genres)}
+
+# --- Batched metadata resolver (spotify.py resolve) ---
+
+def valid_id(ident):
+    """Whether `ident` looks like a Spotify ID (22 base62 characters)."""
+    return re.fullmatch(r"[0-9A-Za-z]{22}", ident) is not None
+
+def _fetch_batch(kind, ids):
+    """(objects, None) for a batch, or ([], error message) if the request failed."""
+    try:
+        data = api(f"/{kind}s?ids={','.join(ids)}", raise_errors=True)
+    except APIError as e:
+        return [], str(e)
+    return [obj for obj in data.get(f"{kind}s", []) if obj], None
+
+def resolve_metadata(uris, db, failed=None):
+    """Map spotify:{track,album,artist}:ID URIs to API objects.
+
+    Each distinct URI is looked up once: first in the metadata table, then
+    via the batch endpoints (RESOLVE_BATCH IDs per request, batches run
+    concurrently). Fetched objects are stored back. Unknown IDs are absent;
+    URIs whose batch request failed are added to `failed` (uri -> error)
+    instead of aborting the rest.
+    """
+    found = {}
+    wanted = collections.defaultdict(list)
+    fresh_after = time.time() - METADATA_TTL
+    for uri in dict.fromkeys(uris):
+        row = db.execute("SELECT json FROM metadata WHERE uri = ? AND fetched_at > ?",
+                         (uri, fresh_after)).fetchone()
+        if row:
+            found[uri] = json.loads(row[0])
+            continue
+        _, kind, ident = uri.split(":", 2)
+        wanted[kind].append(ident)
+
+    batches = [(kind, ids[i:i + RESOLVE_BATCH[kind]])
+               for kind, ids in wanted.items() for i in range(0, len(ids), RESOLVE_BATCH[kind])]
+    with ThreadPoolExecutor(max_workers=PAGE_CONCURRENCY) as pool:
+        for (kind, ids), (objs, error) in zip(batches, pool.map(lambda b: _fetch_batch(*b), batches)):
+            if error and failed is not None:
+                failed.update((f"spotify:{kind}:{ident}", error) for ident in ids)
+            now = time.time()
+            for obj in objs:
+                found[obj["uri"]] = obj
+                db.execute("INSERT OR REPLACE INTO metadata VALUES (?, ?, ?)",
+                           (obj["uri"], json.dumps(obj, ensure_ascii=False), now))
+    db.commit()
+    return found
+
+# --- Listening history beyond the 50-play window (spotify.py history) ---
+
+def _played_ts(played_at):
+    """played_at (ISO 8601, UTC) -> epoch milliseconds, the unit of the `after` cursor."""
+    dt = datetime.datetime.fromisoformat(played_at.replace("Z", "+00:00"))
+    return int(dt.timestamp() * 1000)
+
+def _read_history_log():
+    if not os.path.exists(HISTORY_LOG):
+        return []
+    with open(HISTORY_LOG) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def compact_history(db, force=False):
+    """Fold the append-only log into the plays tables once it is large enough."""
+    with file_lock(HISTORY_LOG + ".lock"):
+        entries = _read_history_log()
+        if not entries or (len(entries) < HISTORY_COMPACT_LINES and not force):
+            return 0
+        for e in entries:
+            db.execute("INSERT OR IGNORE INTO plays VALUES (?, ?, ?, ?, ?, ?, ?)",
+                       (e["played_at"], e["ts"], e["uri"], e["name"],
+                        json.dumps([a["name"] for a in e["artists"]], ensure_ascii=False),
+                        e.get("duration_ms"), e.get("context_uri")))
+            for a in e["artists"]:
+                db.execute("INSERT OR IGNORE INTO play_artists VALUES (?, ?, ?, ?)",
+                           (e["played_at"], e["ts"], a["id"], a["name"]))
+        db.commit()
+        # A crash before the truncate only leaves duplicates the primary keys ignore
+        open(HISTORY_LOG, "w").close()
+        return len(entries)
+
+def ingest_history(db):
+    """Append plays newer than everything stored so far; returns how many were new."""
+    logged = _read_history_log()
+    seen = {e["played_at"] for e in logged}
+    cursor = max([e["ts"] for e in logged] +
+                 [db.execute("SELECT COALESCE(MAX(ts), 0) FROM plays").fetchone()[0]])
+    new = []
+    while True:
+        data = api(f"/me/player/recently-played?limit=50&after={cursor}")
+        items = [i for i in data.get("items", []) if i["played_at"] not in seen]
+        if not items:
+            break
+        for item in items:
+            t = item["track"]
+            seen.add(item["played_at"])
+            new.append({
+                "played_at": item["played_at"], "ts": _played_ts(item["played_at"]),
+                "uri": t["uri"], "name": t["name"], "duration_ms": t.get("duration_ms"),
+                "artists": [{"id": a["id"], "name": a["name"]} for a in t["artists"]],
+                "context_uri": (item.get("context") or {}).get("uri"),
+            })
+        cursor = max(e["ts"] for e in new)
+        if len(data["items"]) < 50:
+            break
+    if new:
+        new.sort(key=lambda e: e["ts"])
+        with file_lock(HISTORY_LOG + ".lock"), open(HISTORY_LOG, "a") as f:
+            f.write("".join(json.dumps(e, ensure_ascii=False) + "\n" for e in new))
+            f.flush()
+            os.fsync(f.fileno())
+    compact_history(db)
+    return len(new)
+
+def history_since(argv):
+    """Epoch ms lower bound from a --days N option (0 = all history)."""
+    if "--days" not in argv:
+        return 0
+    days = float(argv[argv.index("--days") + 1])
+    return int((time.time() - days * 86400) * 1000)
+
+# --- now --watch ---
+
+def player_state(data):
+    """The parts of /me/player whose changes --watch reports."""
+    item = (data or {}).get("item") or {}
+    device = (data or {}).get("device") or {}
+    return {
+        "track": item.get("uri"),
+        "is_playing": bool((data or {}).get("is_playing")),
+        "device": device.get("id"),
+    }
+
+def watch_delay(data, fast_polls):
+    """Seconds until the next poll, derived from where the current track is."""
+    if fast_polls:
+        return WATCH_MIN_INTERVAL
+    item = (data or {}).get("item")
+    if not item or not data.get("is_playing"):
+        return WATCH_MAX_INTERVAL
+    remaining = (item.get("duration_ms", 0) - data.get("progress_ms", 0)) / 1000
+    if remaining <= WATCH_END_LEAD:
+        return WATCH_MIN_INTERVAL
+    return min(remaining - WATCH_END_LEAD, WATCH_MAX_INTERVAL)
+
+def watch_now():
+    """Print one JSON line per track / play-pause / device change, until interrupted."""
+    last = None
+    fast_polls = 0
+    try:
+        while True:
+            data = api("/me/player")
+            state = player_state(data)
+            if state != last:
+                item = data.get("item") or {}
+                changed = [k for k in state if last is None or state[k] != last[k]]
+                print(json.dumps({
+                    "ts": int(time.time()),
+                    "changed": changed,
+                    **state,
+                    "name": item.get("name"),
+                    "artists": [a["name"] for a in item.get("artists", [])],
+                    "progress_ms": data.get("progress_ms"),
+                    "duration_ms": item.get("duration_ms"),
+                    "device_name": (data.get("device") or {}).get("name"),
+                }, ensure_ascii=False), flush=True)
+                if last is not None:
+                    fast_polls = WATCH_FAST_POLLS
+                last = state
+            elif fast_polls:
+                fast_polls -= 1
+            time.sleep(watch_delay(data, fast_polls))
+    except KeyboardInterrupt:
+        pass
 
 def print_tracks(items, numbered=True):
     for i, t in enumerate(items, 1):
@@ -203,19 +1151,113 @@ def print_tracks(items, numbered=True):
         prefix = f"{i}. " if numbered else ""
         print(f"{prefix}{t['name']} — {artists}")
 
-if __name__ == "__main__":
-    cmd = sys.argv[1] if len(sys.argv) > 1 else "help"
+# --- Resident daemon (spotify.py serve) ---
+
+class _ClientGone(Exception):
+    """The client closed its end of the daemon socket mid-command."""
+
+class _StreamWriter:
+    """File-like object relaying a command's output to the client as NDJSON frames."""
+    def __init__(self, conn, stream):
+        self.conn, self.stream = conn, stream
+
+    def write(self, text):
+        if text:
+            try:
+                self.conn.sendall(json.dumps({self.stream: text}, ensure_ascii=False).encode() + b"\n")
+            except OSError as e:
+                raise _ClientGone() from e
+        return len(text)
+
+    def flush(self):
+        pass
+
+def _serve_one(conn, lock):
+    with conn:
+        try:
+            request = json.loads(conn.makefile("rb").readline())
+        except ValueError:
+            return
+        out, err = _StreamWriter(conn, "out"), _StreamWriter(conn, "err")
+        code = 0
+        try:
+            # Commands share process-wide stdout/argv state, so they run one at a time
+            with lock, contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+                try:
+                    main(["spotify.py", *request["argv"]], request.get("account"))
+                except SystemExit as e:
+                    if isinstance(e.code, str):
+                        print(e.code, file=sys.stderr)
+                    code = e.code if isinstance(e.code, int) else int(e.code is not None)
+                except _ClientGone:
+                    raise
+                except Exception as e:
+                    print(f"Error: {e!r}", file=sys.stderr)
+                    code = 1
+            conn.sendall(json.dumps({"exit": code}).encode() + b"\n")
+        except (_ClientGone, OSError):
+            pass  # client hung up
+
+def serve():
+    """Keep tokens, connection pool and caches warm behind DAEMON_SOCKET.
+
+    Also refreshes every account's token on its staggered schedule.
+    """
+    if forward_to_daemon(["ping"]) is not None:
+        print(f"Already running: {DAEMON_SOCKET}")
+        sys.exit(1)
+    if os.path.exists(DAEMON_SOCKET):
+        os.remove(DAEMON_SOCKET)  # left behind by a daemon that died
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(0o077)  # socket is 0600 from the moment it exists
+    try:
+        server.bind(DAEMON_SOCKET)
+    finally:
+        os.umask(old_umask)
+    server.listen(16)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    lock = threading.Lock()
+    threading.Thread(target=_vault_refresher, daemon=True).start()
+    print(f"Serving on {DAEMON_SOCKET}")
+    sys.stdout.flush()
+    try:
+        while True:
+            conn, _ = server.accept()
+            threading.Thread(target=_serve_one, args=(conn, lock), daemon=True).start()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        os.remove(DAEMON_SOCKET)
+
+def main(argv, account=None):
+    """Run one CLI command; argv is the full argument vector including argv[0].
+
+    The account comes from --account, else `account` (SPOTIFY_ACCOUNT).
+    """
+    argv = list(argv)
+    if "--account" in argv:
+        idx = argv.index("--account")
+        account = argv[idx + 1] if idx + 1 < len(argv) else None
+        del argv[idx:idx + 2]
+    select_account(account)
+    local = "--local" in argv  # read commands: use the sync'd mirror, no API calls
+    if local:
+        argv.remove("--local")
+    cmd = argv[1] if len(argv) > 1 else "help"
 
     if cmd == "config":
-        if "--client-id" in sys.argv:
-            idx = sys.argv.index("--client-id")
-            if idx + 1 < len(sys.argv):
-                save_config(sys.argv[idx + 1])
+        if "--client-id" in argv:
+            idx = argv.index("--client-id")
+            if idx + 1 < len(argv):
+                save_config(argv[idx + 1])
             else:
                 print("Usage: spotify.py config --client-id YOUR_CLIENT_ID")
         else:
-            if os.path.exists(CONFIG_FILE):
-                with open(CONFIG_FILE) as f:
+            path = os.path.join(ACCOUNT_DIR, "config.json")
+            path = path if os.path.exists(path) else CONFIG_FILE
+            if os.path.exists(path):
+                with open(path) as f:
                     print(json.dumps(json.load(f), indent=2))
             else:
                 print("No config found.")
@@ -223,29 +1265,83 @@ if __name__ == "__main__":
     elif cmd == "auth":
         auth()
 
+    elif cmd == "serve":
+        serve()
+
+    elif cmd == "ping":
+        print("pong")
+
+    elif cmd == "accounts":
+        if len(argv) > 2 and argv[2] == "refresh":
+            refreshed = refresh_vault()
+            print(f"Refreshed: {', '.join(refreshed)}" if refreshed else "Nothing due for refresh.")
+        else:
+            for name in list_accounts():
+                data = load_token(os.path.join(account_dir(name), "token.json"))
+                left = (data.get("expires_at", 0) - time.time()) / 60
+                state = f"expires in {left:.0f} min" if left > 0 else "expired"
+                print(f"- {name or 'default'} ({state if data.get('expires_at') else 'expiry unknown'})")
+
     elif cmd == "top-tracks":
-        time_range = sys.argv[2] if len(sys.argv) > 2 else "medium_term"
-        limit = int(sys.argv[3]) if len(sys.argv) > 3 else 50
-        data = api(f"/me/top/tracks?limit={limit}&time_range={time_range}")
-        print_tracks(data["items"])
+        time_range = argv[2] if len(argv) > 2 else "medium_term"
+        limit = int(argv[3]) if len(argv) > 3 else None
+        print_tracks(paginate(f"/me/top/tracks?limit={page_size(limit, 50)}&time_range={time_range}", limit=limit))
 
     elif cmd == "top-artists":
-        time_range = sys.argv[2] if len(sys.argv) > 2 else "medium_term"
-        limit = int(sys.argv[3]) if len(sys.argv) > 3 else 50
-        data = api(f"/me/top/artists?limit={limit}&time_range={time_range}")
-        for i, a in enumerate(data["items"], 1):
+        time_range = argv[2] if len(argv) > 2 else "medium_term"
+        limit = int(argv[3]) if len(argv) > 3 else None
+        artists = paginate(f"/me/top/artists?limit={page_size(limit, 50)}&time_range={time_range}", limit=limit)
+        for i, a in enumerate(artists, 1):
             genres = ", ".join(a.get("genres", [])[:3])
             g = f" ({genres})" if genres else ""
             print(f"{i}. {a['name']}{g}")
 
     elif cmd == "recent":
-        limit = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+        limit = int(argv[2]) if len(argv) > 2 else 50
         data = api(f"/me/player/recently-played?limit={limit}")
         for i, item in enumerate(data["items"], 1):
             t = item["track"]
             artists = ", ".join(a["name"] for a in t["artists"])
             print(f"{i}. {t['name']} — {artists}")
 
+    elif cmd == "history":
+        sub = argv[2] if len(argv) > 2 else "recent"
+        db = open_library()
+        positional = [a for i, a in enumerate(argv[3:], 3)
+                      if not a.startswith("--") and not argv[i - 1].startswith("--")]
+        limit = int(positional[0]) if positional else 50
+        if sub == "ingest":
+            interval = int(argv[argv.index("--interval") + 1]) if "--interval" in argv else None
+            while True:
+                print(f"{ingest_history(db)} new play(s) recorded.", flush=True)
+                if not interval:
+                    break
+                time.sleep(interval)
+        elif sub == "recent":
+            compact_history(db, force=True)
+            rows = db.execute("SELECT track_name, artists, played_at FROM plays "
+                              "ORDER BY ts DESC LIMIT ?", (limit,))
+            for i, (name, artists, played_at) in enumerate(rows, 1):
+                print(f"{i}. {name} — {', '.join(json.loads(artists))} ({played_at[:16].replace('T', ' ')})")
+        elif sub == "top-tracks":
+            compact_history(db, force=True)
+            rows = db.execute("SELECT track_name, artists, COUNT(*) AS n FROM plays WHERE ts >= ? "
+                              "GROUP BY track_uri ORDER BY n DESC LIMIT ?", (history_since(argv), limit))
+            for i, (name, artists, n) in enumerate(rows, 1):
+                print(f"{i}. {name} — {', '.join(json.loads(artists))} ({n} plays)")
+        elif sub == "top-artists":
+            compact_history(db, force=True)
+            rows = db.execute("SELECT artist_name, COUNT(*) AS n FROM play_artists WHERE ts >= ? "
+                              "GROUP BY artist_id ORDER BY n DESC LIMIT ?", (history_since(argv), limit))
+            for i, (name, n) in enumerate(rows, 1):
+                print(f"{i}. {name} ({n} plays)")
+        else:
+            print("Usage: spotify.py history <ingest [--interval S]|recent [n]|top-tracks [n] [--days N]|top-artists [n] [--days N]>")
+            sys.exit(1)
+
+    elif cmd == "now" and "--watch" in argv:
+        watch_now()
+
     elif cmd == "now":
         data = api("/me/player/currently-playing")
         if not data or not data.get("item"):
@@ -261,38 +1357,72 @@ if __name__ == "__main__":
             print(f"  Album: {t['album']['name']}")
 
     elif cmd == "playlists":
-        data = api("/me/playlists?limit=50")
-        for i, p in enumerate(data["items"], 1):
+        playlists = local_playlists() if local else paginate("/me/playlists?limit=50")
+        for i, p in enumerate(playlists, 1):
             total = p.get("tracks", {}).get("total", "?")
             print(f"{i}. {p['name']} ({total} tracks) — id:{p['id']}")
 
     elif cmd == "playlist":
-        pid = sys.argv[2]
-        limit = int(sys.argv[3]) if len(sys.argv) > 3 else 100
-        data = api(f"/playlists/{pid}/tracks?limit={limit}")
-        for i, item in enumerate(data["items"], 1):
+        pid = argv[2]
+        limit = int(argv[3]) if len(argv) > 3 else None
+        if local:
+            items = local_playlist_tracks(pid, limit)
+        else:
+            items = paginate(f"/playlists/{pid}/tracks?limit={page_size(limit, 100)}", limit=limit)
+        for i, item in enumerate(items, 1):
             t = item.get("track")
             if t:
                 artists = ", ".join(a["name"] for a in t["artists"])
                 print(f"{i}. {t['name']} — {artists}")
 
     elif cmd == "saved":
-        limit = int(sys.argv[2]) if len(sys.argv) > 2 else 50
-        data = api(f"/me/tracks?limit={limit}")
-        for i, item in enumerate(data["items"], 1):
+        limit = int(argv[2]) if len(argv) > 2 else None
+        if local:
+            items = local_saved(limit)
+        else:
+            items = paginate(f"/me/tracks?limit={page_size(limit, 50)}", limit=limit)
+        for i, item in enumerate(items, 1):
             t = item["track"]
             artists = ", ".join(a["name"] for a in t["artists"])
             print(f"{i}. {t['name']} — {artists}")
 
     elif cmd == "following":
-        data = api("/me/following?type=artist&limit=50")
-        for i, a in enumerate(data["artists"]["items"], 1):
+        if local:
+            artists = local_following()
+        else:
+            artists = paginate("/me/following?type=artist&limit=50", key="artists")
+        for i, a in enumerate(artists, 1):
             genres = ", ".join(a.get("genres", [])[:3])
             g = f" ({genres})" if genres else ""
             print(f"{i}. {a['name']}{g}")
 
+    elif cmd == "sync":
+        stats = sync_library(open_library())
+        print(f"Synced {stats['playlists']} playlists ({stats['playlists_changed']} changed), "
+              f"{stats['saved_new']} new saved tracks, {stats['following']} followed artists.")
+
+    elif cmd == "resolve":
+        default_type = argv[argv.index("--type") + 1] if "--type" in argv else "track"
+        refs = [line.strip() for line in sys.stdin if line.strip()]
+        uris = [to_uri(ref, default_type) for ref in refs]
+
+        def problem(uri):
+            parts = uri.split(":")
+            if len(parts) != 3 or parts[1] not in RESOLVE_BATCH:
+                return "unsupported type"
+            # One malformed ID makes Spotify reject its whole batch
+            return None if valid_id(parts[2]) else "invalid id"
+
+        failed = {}
+        found = resolve_metadata([u for u in uris if not problem(u)], open_library(), failed)
+        for ref, uri in zip(refs, uris):
+            obj = found.get(uri)
+            if obj is None:
+                obj = {"input": ref, "uri": uri, "error": problem(uri) or failed.get(uri, "not found")}
+            print(json.dumps(obj, ensure_ascii=False))
+
     elif cmd == "search":
-        query = " ".join(sys.argv[2:])
+        query = " ".join(argv[2:])
         if not query:
             print("Usage: spotify.py search <query>")
             sys.exit(1)
@@ -306,8 +1436,8 @@ if __name__ == "__main__":
                 print(f"{i}. {a['name']} (followers: {a.get('followers', {}).get('total', '?')})")
 
     elif cmd == "play":
-        if len(sys.argv) > 2:
-            uri = sys.argv[2]
+        if len(argv) > 2:
+            uri = argv[2]
             if uri.startswith("spotify:"):
                 if "track" in uri:
                     api("/me/player/play", "PUT", {"uris": [uri]})
@@ -315,7 +1445,7 @@ if __name__ == "__main__":
                     api("/me/player/play", "PUT", {"context_uri": uri})
             else:
                 # Search and play first result
-                data = api(f"/search?q={urllib.parse.quote(' '.join(sys.argv[2:]))}&type=track&limit=1")
+                data = api(f"/search?q={urllib.parse.quote(' '.join(argv[2:]))}&type=track&limit=1")
                 if data.get("tracks", {}).get("items"):
                     track = data["tracks"]["items"][0]
                     artists = ", ".join(a["name"] for a in track["artists"])
@@ -347,7 +1477,7 @@ if __name__ == "__main__":
             print(f"- {d['name']} ({d['type']}){active} — id:{d['id']}")
 
     elif cmd == "create-playlist":
-        name = sys.argv[2] if len(sys.argv) > 2 else "New Playlist"
+        name = argv[2] if len(argv) > 2 else "New Playlist"
         me = api("/me")
         data = api(f"/users/{me['id']}/playlists", "POST", {
             "name": name,
@@ -356,19 +1486,42 @@ if __name__ == "__main__":
         print(f"Created: {data['name']} — id:{data['id']}")
 
     elif cmd == "add-to-playlist":
-        if len(sys.argv) < 4:
+        args = argv[3:]
+        resume = "--resume" in args
+        if resume:
+            args.remove("--resume")
+        source = None
+        if "--file" in args:
+            idx = args.index("--file")
+            source = args[idx + 1] if idx + 1 < len(args) else "-"
+            del args[idx:idx + 2]
+        elif "-" in args:
+            args.remove("-")
+            source = "-"
+        if len(argv) < 3 or (not args and source is None):
             print("Usage: spotify.py add-to-playlist <playlist_id> <track_uri> [track_uri...]")
+            print("       spotify.py add-to-playlist <playlist_id> --file <path|-> [--resume]")
             sys.exit(1)
-        pid = sys.argv[2]
-        uris = sys.argv[3:]
-        api(f"/playlists/{pid}/tracks", "POST", {"uris": uris})
-        print(f"Added {len(uris)} track(s) to playlist.")
+        pid = argv[2]
+        uris = list(read_uris(args))
+        if source is None:
+            # Plain argv URIs: no state file, no snapshot check.
+            for chunk in chunked(uris, ADD_CHUNK):
+                api(f"/playlists/{pid}/tracks", "POST", {"uris": chunk})
+            print(f"Added {len(uris)} track(s) to playlist.")
+        elif source == "-":
+            added = bulk_add(pid, itertools.chain(uris, read_uris(sys.stdin)), resume=resume)
+            print(f"Added {added} track(s) to playlist.")
+        else:
+            with open(source) as f:
+                added = bulk_add(pid, itertools.chain(uris, read_uris(f)), resume=resume)
+            print(f"Added {added} track(s) to playlist.")
 
     elif cmd == "raw":
         # Raw API call: spotify.py raw GET /me/player
-        method = sys.argv[2].upper() if len(sys.argv) > 2 else "GET"
-        endpoint = sys.argv[3] if len(sys.argv) > 3 else "/me"
-        body = json.loads(sys.argv[4]) if len(sys.argv) > 4 else None
+        method = argv[2].upper() if len(argv) > 2 else "GET"
+        endpoint = argv[3] if len(argv) > 3 else "/me"
+        body = json.loads(argv[4]) if len(argv) > 4 else None
         result = api(endpoint, method, body)
         print(json.dumps(result, indent=2, ensure_ascii=False))
 
@@ -380,17 +1533,28 @@ Usage: spotify.py <command> [args]
 Setup:
   config --client-id ID   Save Spotify app client ID
   auth                    Authenticate with Spotify (opens browser)
+  accounts                List accounts and token expiry
+  accounts refresh        Refresh tokens that are due (serve does this automatically)
+  --account NAME          Use another account (or set SPOTIFY_ACCOUNT); works with any command
 
 Info:
   now                     Currently playing track
-  top-tracks [range] [n]  Top tracks (short_term|medium_term|long_term)
+  now --watch             Stream JSON lines on track/play-pause/device changes
+  top-tracks [range] [n]  Top tracks (short_term|medium_term|long_term; default: all)
   top-artists [range] [n] Top artists
   recent [n]              Recently played
+  history ingest [--interval S]   Record new plays to the local history (loop every S s)
+  history recent [n]              Plays from the local history
+  history top-tracks [n] [--days N]   Most played tracks in local history
+  history top-artists [n] [--days N]  Most played artists in local history
   playlists               List your playlists
-  playlist <id> [n]       Show tracks in a playlist
-  saved [n]               Liked/saved tracks
+  playlist <id> [n]       Show tracks in a playlist (default: all)
+  saved [n]               Liked/saved tracks (default: all)
   following               Followed artists
+  sync                    Update the local library mirror (playlists, saved, following)
+  --local                 With playlists/playlist/saved/following: read the mirror
   search <query>          Search tracks and artists
+  resolve [--type T]      IDs/URIs on stdin -> NDJSON metadata (tracks, albums, artists)
   devices                 List available devices
 
 Playback:
@@ -402,6 +1566,13 @@ Playback:
 Playlists:
   create-playlist <name>          Create a new playlist
   add-to-playlist <id> <uris...>  Add tracks to playlist
+  add-to-playlist <id> --file <path|-> [--resume]
+                                  Bulk add URIs/IDs or NDJSON lines (100 per request)
 
 Advanced:
-  raw <METHOD> <endpoint> [body]  Raw Spotify API call""")
+  raw <METHOD> <endpoint> [body]  Raw Spotify API call
+  serve                           Run a resident daemon; other invocations forward to it""")
+
+
+if __name__ == "__main__":
+    main(sys.argv, os.environ.get("SPOTIFY_ACCOUNT"))